@@ -2,9 +2,13 @@ import pandas as pd
 import plotly.graph_objects as go
 import numpy as np
 import json
+import base64
 import warnings
 import re
 import os
+from dataset import Dataset, read_projected_csv
+from utils import FC_THRESHOLD, P_THRESHOLD
+from volcano_plot import LARGE_PLOT_POINTS, DECIMATION_GRID, decimate_background, threshold_shapes
 
 
 def clean_column_names(columns):
@@ -12,6 +16,9 @@ def clean_column_names(columns):
 
 
 def clean_cell_values(series):
+    # Numeric columns were already parsed on load and have nothing to strip
+    if pd.api.types.is_numeric_dtype(series):
+        return series
     series = series.astype(object)
     series = series.where(series.notna(), '')
     series = series.astype(str)
@@ -21,21 +28,38 @@ def clean_cell_values(series):
         return series
 
 
-def robust_load_csv(filepath, expected_columns=None):
+# Columns the plot reads from an export besides the mapped comparison columns
+DATA_COLUMNS = {'Compounds ID', 'Name', 'Formula', 'Calc. MW', 'm/z', 'RT [min]'}
+NUMERIC_COLUMNS = {'Calc. MW', 'm/z', 'RT [min]'}
+
+
+def robust_load_csv(filepath, expected_columns=None, usecols=None, numeric_columns=()):
+    if isinstance(filepath, Dataset):
+        return clean_loaded_frame(filepath.frame(), expected_columns, usecols)
+
     try:
-        df = pd.read_csv(
-            filepath,
-            encoding="ISO-8859-1",
-            engine="python",
-            sep=",",
-            quotechar='"',
-            on_bad_lines="skip"
-        )
+        if usecols is not None:
+            df = read_projected_csv(filepath, usecols, numeric_columns)
+        else:
+            df = pd.read_csv(
+                filepath,
+                encoding="ISO-8859-1",
+                engine="python",
+                sep=",",
+                quotechar='"',
+                on_bad_lines="skip"
+            )
     except Exception as e:
         raise RuntimeError(f"[ERROR] Could not load {filepath}: {e}")
 
+    return clean_loaded_frame(df, expected_columns)
+
+
+def clean_loaded_frame(df, expected_columns=None, usecols=None):
     df.columns = clean_column_names(df.columns)
     df = df.loc[:, ~df.columns.duplicated()]
+    if usecols is not None:
+        df = df.loc[:, df.columns.isin(usecols)]
 
     for col in df.columns:
         df[col] = clean_cell_values(df[col])
@@ -53,7 +77,8 @@ def apply_fallback_names(df):
             df[col] = np.nan
         else:
             df[col] = clean_cell_values(df[col])
-    df['Name'] = df['Name'].fillna(df['Formula']).fillna(df['Calc. MW'])
+    mw_text = df['Calc. MW'].astype(str).where(df['Calc. MW'].notna())
+    df['Name'] = df['Name'].fillna(df['Formula']).fillna(mw_text)
     return df
 
 
@@ -65,29 +90,76 @@ def ensure_column(df, col, default=''):
     return df
 
 
-def generate_volcano_plot(csv_file, mapping_file, distance_file, output_html):
-    csv_key = os.path.basename(csv_file)
+# Compact export: hover metadata is stored once as customdata, and each
+# comparison's x/y and color codes are embedded as base64 typed arrays that the
+# dropdown swaps into a single trace in the browser.
+HOVER_COLUMNS = ['Name', 'Formula', 'Calc. MW', 'm/z', 'RT [min]']
+COMPACT_HOVERTEMPLATE = "<br>".join(
+    f"{col}:\t%{{customdata[{i}]}}" for i, col in enumerate(HOVER_COLUMNS)) + "<extra></extra>"
+
+# Color codes 0-3 are drawn as blue/red/green/gold through a stepped colorscale
+COLOR_CODES = {'blue': 0, 'red': 1, 'green': 2, 'gold': 3}
+CODE_COLORSCALE = [[0, 'blue'], [1/6, 'blue'], [1/6, 'red'], [1/2, 'red'],
+                   [1/2, 'green'], [5/6, 'green'], [5/6, 'gold'], [1, 'gold']]
+
+COMPACT_SCRIPT = """
+var plot = document.getElementById('{plot_id}');
+var comparisons = __COMPARISONS__;
+function decode(data, Type) {
+    var bytes = Uint8Array.from(atob(data), function (c) { return c.charCodeAt(0); });
+    return new Type(bytes.buffer);
+}
+function show(i) {
+    var c = comparisons[i];
+    Plotly.restyle(plot, {
+        x: [decode(c.x, Float32Array)],
+        y: [decode(c.y, Float32Array)],
+        'marker.color': [decode(c.color, Uint8Array)],
+        name: c.title
+    }, [0]);
+}
+plot.on('plotly_buttonclicked', function (event) { show(event.active); });
+show(0);
+"""
+
+
+def encode_array(values, dtype):
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode('ascii')
+
+
+def generate_volcano_plot(csv_file, mapping_file, distance_file, output_html,
+                          webgl_threshold=LARGE_PLOT_POINTS, decimation_grid=DECIMATION_GRID,
+                          compact=False, fc_threshold=FC_THRESHOLD, p_threshold=P_THRESHOLD):
+    csv_key = csv_file.key if isinstance(csv_file, Dataset) else os.path.basename(csv_file)
+
+    # Load column mapping
+    with open(mapping_file) as f:
+        mapping_data = json.load(f)
+
+    comparisons = mapping_data.get(csv_key, [])
+    if not comparisons:
+        raise ValueError(f"No comparisons found under '{csv_key}' in {mapping_file}")
 
     # Load distance results
-    distance_df = robust_load_csv(distance_file, expected_columns={'Compounds ID', 'Calc. MW', 'Name'})
+    distance_columns = {'Compounds ID', 'Calc. MW', 'Name'}
+    distance_df = robust_load_csv(distance_file, expected_columns=distance_columns,
+                                  usecols=distance_columns, numeric_columns=NUMERIC_COLUMNS)
     distance_df = apply_fallback_names(distance_df)
     gold_ids = distance_df['Compounds ID'].dropna().astype(str).tolist()
 
-    # Load raw CSV data
-    raw_data = robust_load_csv(csv_file)
+    # Load raw CSV data, reading only the columns the plot and the mapping use
+    comparison_columns = {entry.get(key) for entry in comparisons for key in ("fold_change_col", "p_value_col")}
+    raw_data = robust_load_csv(csv_file, usecols=DATA_COLUMNS | comparison_columns,
+                               numeric_columns=NUMERIC_COLUMNS | comparison_columns)
     raw_data = apply_fallback_names(raw_data)
     raw_data = ensure_column(raw_data, 'm/z')
     raw_data = ensure_column(raw_data, 'RT [min]')
     raw_data['Compounds ID'] = raw_data['Compounds ID'].astype(str)
     raw_data['Gold'] = raw_data['Compounds ID'].isin(gold_ids)
 
-    # Load column mapping
-    with open(mapping_file) as f:
-        mapping_data = json.load(f)
-
-    comparisons = mapping_data.get(csv_key, [])
-    if not comparisons:
-        raise ValueError(f"No comparisons found under '{csv_key}' in {mapping_file}")
+    if compact:
+        return write_compact_volcano_plot(raw_data, comparisons, output_html, webgl_threshold, decimation_grid,
+                                          fc_threshold, p_threshold)
 
     # Build plot
     fig = go.Figure()
@@ -106,24 +178,34 @@ def generate_volcano_plot(csv_file, mapping_file, distance_file, output_html):
         raw_data[pv_col] = pd.to_numeric(clean_cell_values(raw_data[pv_col]), errors='coerce')
         raw_data['-Log10(P-value)'] = -np.log10(raw_data[pv_col])
 
-        sig_up = (raw_data[fc_col] > 0.5) & (raw_data[pv_col] < 0.05)
-        sig_down = (raw_data[fc_col] < -0.5) & (raw_data[pv_col] < 0.05)
+        sig_up = (raw_data[fc_col] > fc_threshold) & (raw_data[pv_col] < p_threshold)
+        sig_down = (raw_data[fc_col] < -fc_threshold) & (raw_data[pv_col] < p_threshold)
 
         color_map = np.where(raw_data['Gold'], 'gold',
                       np.where(sig_up, 'green',
                       np.where(sig_down, 'red', 'blue')))
 
+        # Large exports: WebGL trace with the insignificant background thinned out
+        plotted = raw_data
+        large = webgl_threshold is not None and len(raw_data) > webgl_threshold
+        if large and decimation_grid:
+            rows = decimate_background(raw_data[fc_col], raw_data['-Log10(P-value)'],
+                                       color_map == 'blue', decimation_grid)
+            plotted = raw_data.iloc[rows]
+            color_map = color_map[rows]
+
         hover_text = (
-            "Name:\t" + raw_data['Name'].astype(str) + "<br>" +
-            "Formula:\t" + raw_data['Formula'].astype(str) + "<br>" +
-            "Calc. MW:\t" + raw_data['Calc. MW'].astype(str) + "<br>" +
-            "m/z:\t" + raw_data['m/z'].astype(str) + "<br>" +
-            "RT [min]:\t" + raw_data['RT [min]'].astype(str)
+            "Name:\t" + plotted['Name'].astype(str) + "<br>" +
+            "Formula:\t" + plotted['Formula'].astype(str) + "<br>" +
+            "Calc. MW:\t" + plotted['Calc. MW'].astype(str) + "<br>" +
+            "m/z:\t" + plotted['m/z'].astype(str) + "<br>" +
+            "RT [min]:\t" + plotted['RT [min]'].astype(str)
         )
 
-        fig.add_trace(go.Scatter(
-            x=raw_data[fc_col],
-            y=raw_data['-Log10(P-value)'],
+        scatter = go.Scattergl if large else go.Scatter
+        fig.add_trace(scatter(
+            x=plotted[fc_col],
+            y=plotted['-Log10(P-value)'],
             mode='markers',
             marker=dict(color=color_map, opacity=0.9),
             hovertext=hover_text,
@@ -142,10 +224,15 @@ def generate_volcano_plot(csv_file, mapping_file, distance_file, output_html):
                    "yaxis": {"title": f"-Log10({pv_col})"}}]
         ))
 
+    finish_figure(fig, dropdown_buttons, comparisons[0], fc_threshold, p_threshold)
+    fig.write_html(output_html)
+    print(f"✅ Volcano plot generated and saved as '{output_html}'")
+
+def finish_figure(fig, dropdown_buttons, first, fc_threshold=FC_THRESHOLD, p_threshold=P_THRESHOLD):
     # Add legend traces
     legend_traces = [
         go.Scatter(x=[None], y=[None], mode='markers', marker=dict(size=12, color='gold'),
-                   showlegend=True, name='Top 50 Distance'),
+                   showlegend=True, name='Gold (nearest to corner)'),
         go.Scatter(x=[None], y=[None], mode='markers', marker=dict(size=12, color='green'),
                    showlegend=True, name='Significant Upregulated'),
         go.Scatter(x=[None], y=[None], mode='markers', marker=dict(size=12, color='red'),
@@ -168,23 +255,81 @@ def generate_volcano_plot(csv_file, mapping_file, distance_file, output_html):
             y=1.15,
             yanchor="top"
         )],
-        title=comparisons[0]["title"],
-        xaxis_title=comparisons[0]["fold_change_col"],
-        yaxis_title=f"-Log10({comparisons[0]['p_value_col']})",
+        title=first["title"],
+        xaxis_title=first["fold_change_col"],
+        yaxis_title=f"-Log10({first['p_value_col']})",
         plot_bgcolor="lightslategray",
         paper_bgcolor="lightslategray",
         font=dict(color="black"),
-        shapes=[
-            dict(type="line", x0=-8, x1=8, y0=-np.log10(0.05), y1=-np.log10(0.05),
-                 line=dict(color="Black", dash="dash")),
-            dict(type="line", x0=-0.5, x1=-0.5, y0=0, y1=1, yref="paper",
-                 line=dict(color="Black", dash="dash")),
-            dict(type="line", x0=0.5, x1=0.5, y0=0, y1=1, yref="paper",
-                 line=dict(color="Black", dash="dash"))
-        ]
+        shapes=threshold_shapes(fc_threshold, p_threshold, color="Black")
     )
 
     fig.update_xaxes(showgrid=True)
     fig.update_yaxes(showgrid=True)
-    fig.write_html(output_html)
-    print(f"✅ Volcano plot generated and saved as '{output_html}'")
\ No newline at end of file
+
+
+def write_compact_volcano_plot(raw_data, comparisons, output_html, webgl_threshold, decimation_grid,
+                               fc_threshold=FC_THRESHOLD, p_threshold=P_THRESHOLD):
+    shown, points = [], []
+    for i, entry in enumerate(comparisons):
+        fc_col = entry.get("fold_change_col")
+        pv_col = entry.get("p_value_col")
+        if fc_col not in raw_data.columns or pv_col not in raw_data.columns:
+            warnings.warn(f"Skipping comparison due to missing column(s): {fc_col}, {pv_col}")
+            continue
+
+        fold_change = pd.to_numeric(clean_cell_values(raw_data[fc_col]), errors='coerce').to_numpy(dtype=float)
+        p_values = pd.to_numeric(clean_cell_values(raw_data[pv_col]), errors='coerce').to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_p = -np.log10(p_values)
+        sig_up = (fold_change > fc_threshold) & (p_values < p_threshold)
+        sig_down = (fold_change < -fc_threshold) & (p_values < p_threshold)
+        codes = np.where(raw_data['Gold'], COLOR_CODES['gold'],
+                  np.where(sig_up, COLOR_CODES['green'],
+                  np.where(sig_down, COLOR_CODES['red'], COLOR_CODES['blue'])))
+        shown.append(dict(entry, title=entry.get("title", f"Comparison {i+1}")))
+        points.append((fold_change, log_p, codes))
+
+    if not shown:
+        raise ValueError("None of the mapped comparisons have both columns in the data")
+
+    # All comparisons share the customdata rows, so large exports keep the
+    # union of what decimation keeps for each comparison
+    rows = np.arange(len(raw_data))
+    large = webgl_threshold is not None and len(raw_data) > webgl_threshold
+    if large and decimation_grid:
+        keep = np.zeros(len(raw_data), dtype=bool)
+        for fold_change, log_p, codes in points:
+            keep[decimate_background(fold_change, log_p, codes == COLOR_CODES['blue'], decimation_grid)] = True
+        rows = np.flatnonzero(keep)
+
+    encoded = [{
+        "title": entry["title"],
+        "x": encode_array(fold_change[rows], '<f4'),
+        "y": encode_array(log_p[rows], '<f4'),
+        "color": encode_array(codes[rows], 'u1'),
+    } for entry, (fold_change, log_p, codes) in zip(shown, points)]
+
+    # x, y and colors are filled in by COMPACT_SCRIPT once the page loads
+    scatter = go.Scattergl if large else go.Scatter
+    fig = go.Figure(scatter(
+        x=[], y=[],
+        mode='markers',
+        marker=dict(color=[], colorscale=CODE_COLORSCALE, cmin=0, cmax=3, opacity=0.9),
+        customdata=raw_data.iloc[rows][HOVER_COLUMNS].astype(str).to_numpy(),
+        hovertemplate=COMPACT_HOVERTEMPLATE,
+        name=shown[0]["title"],
+        hoverlabel=dict(font_size=16, font_family="Arial", bgcolor="red", bordercolor="black")
+    ))
+
+    dropdown_buttons = [dict(
+        method="update",
+        label=entry["title"],
+        args=[{}, {"title": entry["title"],
+                   "xaxis": {"title": entry["fold_change_col"]},
+                   "yaxis": {"title": f"-Log10({entry['p_value_col']})"}}]
+    ) for entry in shown]
+
+    finish_figure(fig, dropdown_buttons, shown[0], fc_threshold, p_threshold)
+    fig.write_html(output_html, post_script=COMPACT_SCRIPT.replace("__COMPARISONS__", json.dumps(encoded)))
+    print(f"✅ Compact volcano plot generated and saved as '{output_html}'")
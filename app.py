@@ -1,22 +1,134 @@
 # app.py - Simplified layout with better proportions
 import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 import param
 import requests
 import panel as pn
-from utils import load_and_prepare_data
-from volcano_plot import generate_plot
+from distCalc import DISTANCES, array_hash
+from utils import DATASETS, MzIndex, TableOrder, TissueIndex, FC_THRESHOLD, P_THRESHOLD
+from diagnostics import DIAGNOSTICS, track_app, current_session_id, start_periodic_log, serve_admin_page
+from volcano_plot import (FigureCache, cached_plot, prebuild_plot, generate_plot, compound_positions,
+                          update_selection, update_thresholds, unlink_figure)
 
 # Initialize Panel extension
 pn.extension('plotly', 'tabulator')
 ENV_CHECK = os.environ.get("ENV_CHECK", "")
 IFTTT_KEY = os.environ.get("IFTTT_API_KEY", "")
+COMPACT_DATA = os.environ.get("COMPACT_DATA", "1") != "0"
+FIGURE_CACHE_SIZE = int(os.environ.get("FIGURE_CACHE_SIZE", "4"))
+TAB_IDLE_TIMEOUT = float(os.environ.get("TAB_IDLE_TIMEOUT", "600"))  # seconds, 0 keeps hidden tabs
+PLOT_OPTIONS = {
+    "webgl_threshold": int(os.environ.get("WEBGL_THRESHOLD", "50000")),
+    "decimation_grid": int(os.environ.get("DECIMATION_GRID", "256")),
+}
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", "4"))
+TABLE_PAGE_SIZE = int(os.environ.get("TABLE_PAGE_SIZE", "50"))
+CROSS_TISSUE_PPM = float(os.environ.get("CROSS_TISSUE_PPM", "10"))
+# Distance cutoff and count the *_by_distance_named.csv files were built with
+# (main.py's defaults); at these values the gold points come from the files
+GOLD_DISTANCE_THRESHOLD = float(os.environ.get("GOLD_DISTANCE_THRESHOLD", "12"))
+GOLD_MAX_RESULTS = int(os.environ.get("GOLD_MAX_RESULTS", "100"))
+SELECTION_DEBOUNCE = float(os.environ.get("SELECTION_DEBOUNCE", "0.15"))  # seconds, 0 handles every event
+SEARCH_DEBOUNCE = float(os.environ.get("SEARCH_DEBOUNCE", "0.3"))  # seconds, 0 handles every keystroke
+
+# Table and figure building for all sessions runs here, so the server's event
+# loop keeps serving other sessions while one builds. Threads rather than
+# processes: the prepared frames are shared in memory and figures would
+# otherwise have to be pickled back.
+EXECUTOR = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="volcano")
+
+async def run_in_pool(func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR, partial(func, *args, **kwargs))
+
+def debounced(callback, delay):
+    # Coalesce a burst of events into one call: each event supersedes the
+    # pending one, and only the last runs once nothing new arrived for `delay`
+    # seconds. The callback should read the widget state, not the event.
+    if delay <= 0:
+        return callback
+    latest = 0
+
+    async def wrapper(event):
+        nonlocal latest
+        latest += 1
+        call = latest
+        await asyncio.sleep(delay)
+        if call != latest:
+            return
+        result = callback(event)
+        if asyncio.iscoroutine(result):
+            await result
+    return wrapper
+
+# Table sort choices: label -> (column, ascending). The table is built sorted
+# by |Log2 Fold|, so that order needs no column.
+TABLE_SORTS = {
+    '|Log2 Fold|': (None, True),
+    'P-value': ('P-val', True),
+    'm/z': ('m/z', True),
+}
+
+def gold_rows(shared, comparisons, distance_threshold, max_results):
+    # Row mask of the compounds nearest their corners in a shared dataset.
+    # Only the first call per dataset computes distances; later cutoffs and
+    # counts are a selection from the memoized totals.
+    ids = shared.df['Compounds ID']
+    arrays = shared.arrays
+    dataset_hash = shared.derived('distance_hash', lambda: array_hash(ids, arrays.fold_change, arrays.p_values))
+    pairs = [(entry.get("fold_change_col"), entry.get("p_value_col")) for entry in comparisons]
+    nearest = DISTANCES.nearest(ids, arrays.fold_change, arrays.p_values, pairs,
+                                distance_threshold, max_results, dataset_hash)
+    return ids.isin(nearest.index).to_numpy()
+
+def comparison_table(df, fc_col, pv_col):
+    # Prepare table data - include hidden columns for functionality
+    table_data = df[[
+        'Compounds ID', 'm/z', 'RT [min]', 'Formula', fc_col, pv_col,
+    ]].dropna(subset=[fc_col]).copy()
+
+    # Rename the columns in the dataframe
+    table_data = table_data.rename(columns={
+        'RT [min]': 'RT',
+        pv_col: 'P-val',
+        fc_col: 'Log2 Fold'
+    })
+
+    # Sort by fold change magnitude
+    table_data['abs_fc'] = abs(table_data['Log2 Fold'])
+    return table_data.sort_values('abs_fc', ascending=False)
 
 class VolcanoApp(param.Parameterized):
     comparison = param.Integer(0)
 
-    def __init__(self, data_file, distance_file, mapping_key, **params):
+    def __init__(self, data_file, distance_file, mapping_key, tissue=None, **params):
         super().__init__(**params)
-        self.df, self.comparisons = load_and_prepare_data(data_file, distance_file, mapping_key)
+        self.data_file = data_file
+        self.tissue = tissue
+        # Data is shared by all sessions; only selection/filter state is per session
+        self.shared = DATASETS.get(data_file, distance_file, mapping_key, compact=COMPACT_DATA)
+        self.df, self.comparisons = self.shared.df, self.shared.comparisons
+        self.compound_positions = self.shared.derived('compound_positions', lambda: compound_positions(self.df))
+        self.figure_cache = FigureCache(maxsize=FIGURE_CACHE_SIZE)
+        self.df_filtered = None
+        # Session gold mask and the (cutoff, count) it was built with; None
+        # means the distance file's gold set
+        self.gold = None
+        self.gold_params = None
+        self.released = False
+        self.session_id = current_session_id()
+        # Bumped by each comparison switch / figure rebuild; a pooled result is
+        # only applied if nothing newer started while it was computed
+        self._comparison_token = 0
+        self._plot_token = 0
+        self._cross_token = 0
+        self._gold_token = 0
+        self._busy = 0
+        track_app(self)
 
 
         # Load data
@@ -34,7 +146,27 @@ class VolcanoApp(param.Parameterized):
 
         # Create search bar
         self.search_input = pn.widgets.TextInput(
-            placeholder='Search m/z...', name='Search'
+            placeholder='Search m/z: 301.2, 300-305 or 301.2 ±10ppm', name='Search'
+        )
+
+        # Server-side table order
+        self.sort_select = pn.widgets.Select(name='Sort table by', options=list(TABLE_SORTS))
+
+        # Significance cutoffs; changing them only recolors the plot
+        self.fc_threshold_input = pn.widgets.FloatInput(
+            name='|Log2 Fold| cutoff', value=FC_THRESHOLD, step=0.1, start=0
+        )
+        self.p_threshold_input = pn.widgets.FloatInput(
+            name='P-value cutoff', value=P_THRESHOLD, step=0.01, start=1e-300, end=1
+        )
+
+        # Gold set: the k compounds nearest their volcano corners below a
+        # distance cutoff, recomputed in memory when these change
+        self.distance_threshold_input = pn.widgets.FloatInput(
+            name='Gold distance cutoff', value=GOLD_DISTANCE_THRESHOLD, step=0.5, start=0
+        )
+        self.max_results_input = pn.widgets.IntInput(
+            name='Gold compounds', value=GOLD_MAX_RESULTS, step=10, start=0
         )
 
         # Create buttons
@@ -61,9 +193,12 @@ class VolcanoApp(param.Parameterized):
             {'field': 'Formula', 'title': 'Formula', 'headerTooltip': 'Chemical Formula'},
         ]
 
-        # Create table
+        # Create table; only the visible page is sent to the browser, and
+        # sorting happens on the server from prebuilt orders
         self.table = pn.widgets.Tabulator(
-            pagination=None,
+            pagination='remote',
+            page_size=TABLE_PAGE_SIZE,
+            sortable=False,
             height=800,
             selectable='checkbox',
             header_align='center',
@@ -71,6 +206,7 @@ class VolcanoApp(param.Parameterized):
             sizing_mode='stretch_width',
             show_index=False,
             theme='midnight',
+            disabled=True,  # rows are shared read-only across sessions
             hidden_columns=['Compounds ID', 'abs_fc']
         )
         self.table.columns = self.table_columns
@@ -78,35 +214,63 @@ class VolcanoApp(param.Parameterized):
         # Plot pane
         self.plot_pane = pn.pane.Plotly(sizing_mode='stretch_width', min_height=900)
 
+        # Selected compounds across all tissues
+        self.cross_table = pn.widgets.Tabulator(
+            pagination='remote',
+            page_size=TABLE_PAGE_SIZE,
+            height=400,
+            layout='fit_columns',
+            sizing_mode='stretch_width',
+            show_index=False,
+            theme='midnight',
+            disabled=True
+        )
+
         # Set up callbacks
-        self.comparison_select.param.watch(self._update_comparison, 'value')
-        self.table.param.watch(self._update_selection, 'selection')
-        self.search_input.param.watch(self._apply_filter, 'value')
+        self.comparison_select.param.watch(self._switch_comparison, 'value')
+        self.sort_select.param.watch(self._change_sort, 'value')
+        # Checkbox clicks and keystrokes come in bursts; only the settled state is processed
+        self.table.param.watch(debounced(self._update_selection, SELECTION_DEBOUNCE), 'selection')
+        self.search_input.param.watch(debounced(self._apply_filter, SEARCH_DEBOUNCE), 'value_input')
+        self.fc_threshold_input.param.watch(self._update_thresholds, 'value')
+        self.p_threshold_input.param.watch(self._update_thresholds, 'value')
+        self.distance_threshold_input.param.watch(self._update_gold, 'value')
+        self.max_results_input.param.watch(self._update_gold, 'value')
         #self.select_all_button.on_click(self._select_all)
         self.clear_all_button.on_click(self._clear_all)
         self.reset_button.on_click(self._reset_app)
-      
-        # Initial update
-        self._update_comparison(None)
-
-    def _update_comparison(self, event):
-        current_comp_idx = self.comparison_select.value
-        self.comparison = current_comp_idx
-
-        fc_col = self.comparisons[current_comp_idx].get("fold_change_col")
-        pv_col = self.comparisons[current_comp_idx].get("p_value_col")
-
-        # Prepare table data - include hidden columns for functionality
-        table_data = self.df[[
-            'Compounds ID', 'm/z', 'RT [min]', 'Formula', fc_col, pv_col,
-        ]].dropna(subset=[fc_col]).copy()
-
-        # Rename the columns in the dataframe
-        table_data = table_data.rename(columns={
-            'RT [min]': 'RT',
-            pv_col: 'P-val',
-            fc_col: 'Log2 Fold'
-        })
+        # The table and figure are built off the event loop by restore()
+
+    async def _switch_comparison(self, event):
+        await self._show_comparison(event.new)
+
+    async def _show_comparison(self, idx):
+        self._comparison_token += 1
+        self._plot_token += 1
+        token = self._comparison_token
+        with self._loading():
+            prepared = await run_in_pool(self._prepare_comparison, idx, self._plot_options(),
+                                         self.sort_select.value)
+        if token == self._comparison_token:
+            self._apply_comparison(idx, *prepared)
+
+    def _prepare_comparison(self, idx, plot_options, sort):
+        # Runs in the worker pool: nothing displayed is touched here
+        fc_col = self.comparisons[idx].get("fold_change_col")
+        pv_col = self.comparisons[idx].get("p_value_col")
+
+        # Sorted table frame, built once per comparison and shared across sessions
+        table_data = self.shared.derived(('table', idx), lambda: comparison_table(self.df, fc_col, pv_col))
+        mz_index = self.shared.derived(('mz_index', idx), lambda: MzIndex(table_data['m/z']))
+        table_order = self._table_order(idx, sort, table_data)
+        fig = prebuild_plot(self.figure_cache, self.data_file, self.df, idx, self.comparisons, **plot_options)
+        return table_data, mz_index, table_order, fig
+
+    def _table_order(self, idx, sort, table_data):
+        return self.shared.derived(('table_order', idx, sort), lambda: TableOrder(table_data, *TABLE_SORTS[sort]))
+
+    def _apply_comparison(self, idx, table_data, mz_index, table_order, fig):
+        self.comparison = idx
 
         # Update table columns with the renamed columns
         self.table_columns = [
@@ -118,40 +282,160 @@ class VolcanoApp(param.Parameterized):
         ]
         self.table.columns = self.table_columns
 
-        # Sort by fold change magnitude
-        table_data['abs_fc'] = abs(table_data['Log2 Fold'])
-        table_data = table_data.sort_values('abs_fc', ascending=False)
-
         # Store the full dataset for filtering
         self.df_filtered = table_data
+        self.mz_index = mz_index
+        self.table_order = table_order
 
         # Reset search filter
-        self.search_input.value = ''
-        self.table.value = table_data
+        self.search_input.value = self.search_input.value_input = ''
         self.table.selection = []
-
-        # Update plot - need to use original column names for the plot
-        self.plot_pane.object = generate_plot(self.df, current_comp_idx, self.comparisons)
+        self.table.value = table_order.frame
+
+        # Update plot; the figure was prebuilt or cached, and only enters the
+        # cache here, on the loop, once the switch is known to be current
+        self._show_figure(cached_plot(
+            self.figure_cache, self.data_file, self.df, idx, self.comparisons,
+            prebuilt=fig, **self._plot_options()))
+
+    def _show_figure(self, fig):
+        # The outgoing figure may stay in the cache and be recolored on a later
+        # hit, so it is unlinked from the pane first
+        previous = self.plot_pane.object
+        if previous is not fig:
+            unlink_figure(previous)
+        self.plot_pane.object = fig
+
+    @contextmanager
+    def _loading(self):
+        self._busy += 1
+        self.plot_pane.loading = self.table.loading = True
+        try:
+            yield
+        finally:
+            self._busy -= 1
+            if not self._busy:
+                self.plot_pane.loading = self.table.loading = False
+
+    async def _regenerate_plot(self, selected_ids, plot_options):
+        # Full figure rebuild in the pool, for selections and cutoffs that
+        # need points the decimated figure dropped
+        self._plot_token += 1
+        token, comparison_token = self._plot_token, self._comparison_token
+        with self._loading():
+            fig = await run_in_pool(generate_plot, self.df, self.comparison, self.comparisons,
+                                    selected_ids, **plot_options)
+        if token == self._plot_token and comparison_token == self._comparison_token:
+            self._show_figure(fig)
+
+    def _plot_options(self):
+        fc_threshold = self.fc_threshold_input.value
+        p_threshold = self.p_threshold_input.value
+        return dict(PLOT_OPTIONS, arrays=self.shared.arrays, gold=self.gold,
+                    fc_threshold=FC_THRESHOLD if fc_threshold is None else fc_threshold,
+                    p_threshold=P_THRESHOLD if p_threshold is None else p_threshold)
+
+    def _selected_ids(self):
+        selected_rows = [self.table.value.iloc[i] for i in self.table.selection]
+        return [str(row['Compounds ID']) for row in selected_rows]
 
     def _apply_filter(self, event):
-        query = event.new.strip()
+        if self.df_filtered is None:
+            return
+        query = (self.search_input.value_input or '').strip()
         if not query:
-            self.table.value = self.df_filtered
+            view = self.table_order.frame
+        else:
+            # Numeric m/z queries go through the sorted index; other text falls
+            # back to substring matching on the 'm/z' column
+            rows = self.mz_index.search(query)
+            if rows is None:
+                rows = self.df_filtered['m/z'].astype(str).str.contains(query, regex=False).to_numpy()
+            view = self.table_order.rows(rows)
+        # Skip resending the table when a reset already restored it. Selection
+        # indices refer to the old view, so they are cleared before it goes.
+        if self.table.value is not view:
+            self.table.selection = []
+            self.table.value = view
+
+    async def _change_sort(self, event):
+        if self.df_filtered is None:
             return
+        token = self._comparison_token
+        with self._loading():
+            table_order = await run_in_pool(self._table_order, self.comparison, event.new, self.df_filtered)
+        if token == self._comparison_token and event.new == self.sort_select.value:
+            self.table_order = table_order
+            self._apply_filter(None)
+
+    async def _update_selection(self, event):
+        selected_ids = self._selected_ids()
+
+        # Patch the selection into the existing figure instead of rebuilding it;
+        # the bumped token drops any rebuild still running for an older selection
+        self._plot_token += 1
+        fig = self.plot_pane.object
+        if fig is not None and not update_selection(fig, self.compound_positions, selected_ids):
+            # A selected compound was decimated away; redraw with it included
+            await self._regenerate_plot(selected_ids, self._plot_options())
+        await self._update_cross_tissue(selected_ids)
+
+    async def _update_cross_tissue(self, selected_ids):
+        self._cross_token += 1
+        token = self._cross_token
+        if not selected_ids:
+            self.cross_table.value = None
+            return
+        # The cross-tissue index loads every tissue the first time it is used
+        options = self._plot_options()
+        self.cross_table.loading = True
+        try:
+            view = await run_in_pool(cross_tissue_view, self.tissue, selected_ids,
+                                     options['fc_threshold'], options['p_threshold'],
+                                     self.gold, self.gold_params)
+        finally:
+            if token == self._cross_token:
+                self.cross_table.loading = False
+        if token == self._cross_token:
+            self.cross_table.value = view
+
+    async def _update_thresholds(self, event):
+        if event.new is None:
+            return
+        await self._recolor()
+        if self.cross_table.value is not None:
+            await self._update_cross_tissue(self._selected_ids())
 
-        # Filter only the 'm/z' column
-        mask = self.df_filtered['m/z'].astype(str).str.contains(query)
-        self.table.value = self.df_filtered[mask]
-
-    def _update_selection(self, event):
-        selected_ids = []
-        if self.table.selection:
-            selected_rows = [self.table.value.iloc[i] for i in self.table.selection]
-            selected_ids = [str(row['Compounds ID']) for row in selected_rows]
-
-        # Update plot with selection
-        self.plot_pane.object = generate_plot(
-            self.df, self.comparison, self.comparisons, selected_ids)
+    async def _recolor(self):
+        fig = self.plot_pane.object
+        if fig is None:
+            return
+        # Reclassify from the cached arrays and push only the new colors
+        self._plot_token += 1
+        options = self._plot_options()
+        if not update_thresholds(fig, self.df, self.comparison, self.comparisons, options['fc_threshold'],
+                                 options['p_threshold'], options['arrays'], options['gold']):
+            # A newly significant or gold point was decimated away; redraw with it included
+            await self._regenerate_plot(self._selected_ids(), options)
+
+    async def _update_gold(self, event):
+        distance_threshold = self.distance_threshold_input.value
+        max_results = self.max_results_input.value
+        if distance_threshold is None or max_results is None:
+            return
+        self._gold_token += 1
+        token = self._gold_token
+        if (distance_threshold, max_results) == (GOLD_DISTANCE_THRESHOLD, GOLD_MAX_RESULTS):
+            gold, gold_params = None, None
+        else:
+            gold_params = (distance_threshold, max_results)
+            with self._loading():
+                gold = await run_in_pool(gold_rows, self.shared, self.comparisons, *gold_params)
+        if token == self._gold_token:
+            self.gold, self.gold_params = gold, gold_params
+            await self._recolor()
+            if self.cross_table.value is not None:
+                await self._update_cross_tissue(self._selected_ids())
 
     #def _select_all(self, event):
     #    self.table.selection = list(range(len(self.table.value)))
@@ -159,16 +443,45 @@ class VolcanoApp(param.Parameterized):
     def _clear_all(self, event):
         self.table.selection = []
   
-    def _reset_app(self, event):
+    async def _reset_app(self, event):
         # Reset search filter
-        self.search_input.value = ''
-        # Reset comparison select to default
-        self.comparison_select.value = 0
+        self.search_input.value = self.search_input.value_input = ''
+        # Reset table order
+        self.sort_select.value = next(iter(TABLE_SORTS))
+        # Reset significance cutoffs
+        self.fc_threshold_input.value = FC_THRESHOLD
+        self.p_threshold_input.value = P_THRESHOLD
+        # Reset the gold set to the distance file's
+        self.distance_threshold_input.value = GOLD_DISTANCE_THRESHOLD
+        self.max_results_input.value = GOLD_MAX_RESULTS
         # Clear table selection
         self.table.selection = []
-        # Reload table data from the original dataframe and update plot
-        self._update_comparison(None)
+        # Back to the default comparison; changing the select switches through
+        # its watcher, otherwise the table and plot are rebuilt here
+        if self.comparison_select.value != 0:
+            self.comparison_select.value = 0
+        else:
+            await self._show_comparison(0)
   
+    def release(self):
+        # Drop the figures and table payload of a hidden tab; restore() rebuilds
+        # them. Bumped tokens discard switches and rebuilds still in the pool.
+        self._comparison_token += 1
+        self._plot_token += 1
+        self._cross_token += 1
+        self.figure_cache.clear()
+        self.plot_pane.object = None
+        self.df_filtered = None
+        self.table.selection = []
+        self.table.value = self.df.iloc[:0][['Compounds ID', 'm/z', 'RT [min]', 'Formula']]
+        self.cross_table.value = None
+        self.released = True
+
+    async def restore(self):
+        # Builds the table and figure of a new or released app in the pool
+        self.released = False
+        await self._show_comparison(self.comparison_select.value)
+
     def panel(self):
 
         # Button row
@@ -184,6 +497,9 @@ class VolcanoApp(param.Parameterized):
             "## Compound Explorer",
             self.comparison_select,
             self.search_input,
+            self.sort_select,
+            pn.Row(self.fc_threshold_input, self.p_threshold_input, sizing_mode='stretch_width'),
+            pn.Row(self.distance_threshold_input, self.max_results_input, sizing_mode='stretch_width'),
             button_row,
             self.table,
             styles={'background': '#606060'},
@@ -196,6 +512,8 @@ class VolcanoApp(param.Parameterized):
         main_panel = pn.Column(
             "## Volcano Plot",
             self.plot_pane,
+            "### Selected compounds across tissues",
+            self.cross_table,
             styles={'background': '#606060'},
             css_classes=['custom-panel'],
             min_width=550,
@@ -230,24 +548,117 @@ def notify_webhook():
                 if response is not None:
                     print(f"[DEBUG] Response status code: {response.status_code}")
 
-# Main entry point
-def main():
-    app1 = VolcanoApp("ReSpleen.csv", "by_distance_named.csv", "ReSpleen.csv")
-    app2 = VolcanoApp("ReKidney.csv", "ReKidney_by_distance_named.csv", "ReKidney.csv")
-    app3 = VolcanoApp("ReLiver.csv", "ReLiver_by_distance_named.csv", "ReLiver.csv")
+# (tab name, data file, distance file, mapping key)
+TISSUES = [
+    ("Spleen", "ReSpleen.csv", "by_distance_named.csv", "ReSpleen.csv"),
+    ("Kidney", "ReKidney.csv", "ReKidney_by_distance_named.csv", "ReKidney.csv"),
+    ("Liver", "ReLiver.csv", "ReLiver_by_distance_named.csv", "ReLiver.csv"),
+]
+
+_tissue_index = None
+_tissue_index_lock = threading.Lock()
+
+def tissue_index():
+    # Join index over every tissue's shared dataset, built on first use;
+    # tissues whose files cannot be loaded are left out
+    global _tissue_index
+    with _tissue_index_lock:
+        if _tissue_index is None:
+            tissues = {}
+            for name, data_file, distance_file, mapping_key in TISSUES:
+                try:
+                    tissues[name] = DATASETS.get(data_file, distance_file, mapping_key, compact=COMPACT_DATA)
+                except (OSError, ValueError, RuntimeError) as e:
+                    print(f"[WARNING] {name} left out of the cross-tissue index: {e}")
+            _tissue_index = TissueIndex(tissues, CROSS_TISSUE_PPM)
+        return _tissue_index
+
+def cross_tissue_view(tissue, compound_ids, fc_threshold=FC_THRESHOLD, p_threshold=P_THRESHOLD,
+                      gold=None, gold_params=None):
+    # Gold follows the session's gold set: its own mask for its tissue and the
+    # same cutoff and count for the others, or every file's set by default
+    index = tissue_index()
+    masks = {}
+    if gold_params is not None:
+        masks = {name: gold if name == tissue else gold_rows(shared, shared.comparisons, *gold_params)
+                 for name, shared in index.tissues.items()}
+    return index.compound_view(tissue, compound_ids, fc_threshold, p_threshold, masks)
+
+def load_tissue(data_file, distance_file, mapping_key):
+    # Runs in the worker pool, so the VolcanoApp built afterwards on the event
+    # loop finds its dataset and compound lookup already in the store
+    shared = DATASETS.get(data_file, distance_file, mapping_key, compact=COMPACT_DATA)
+    shared.derived('compound_positions', lambda: compound_positions(shared.df))
+
+class LazyTabs:
+    # Tabs whose VolcanoApp is only built the first time the tab is opened.
+    # Tabs hidden for longer than idle_timeout seconds release their figures
+    # and table data and rebuild them when shown again.
+    def __init__(self, tissues, idle_timeout=TAB_IDLE_TIMEOUT):
+        self.tissues = tissues
+        self.idle_timeout = idle_timeout
+        self.apps = [None] * len(tissues)
+        self.hidden_since = [None] * len(tissues)
+        self._building = set()
+
+        self.tabs = pn.Tabs(*[(name, pn.Column(sizing_mode='stretch_width')) for name, *_ in tissues])
+        self.tabs.param.watch(self._on_tab_change, 'active')
+        pn.state.onload(partial(self._activate, self.tabs.active))
+
+    async def _on_tab_change(self, event):
+        self.hidden_since[event.old] = time.monotonic()
+        await self._activate(event.new)
+
+    async def _activate(self, index):
+        self.hidden_since[index] = None
+        app = self.apps[index]
+        if app is None:
+            # The dataset is parsed and prepared in the pool behind the tab's
+            # loading indicator; reopening the tab meanwhile leaves that build to finish
+            if index in self._building:
+                return
+            self._building.add(index)
+            column = self.tabs[index]
+            column.loading = True
+            try:
+                name, data_file, distance_file, mapping_key = self.tissues[index]
+                await run_in_pool(load_tissue, data_file, distance_file, mapping_key)
+                app = self.apps[index] = VolcanoApp(data_file, distance_file, mapping_key, tissue=name)
+                column.objects = [app.panel()]
+            finally:
+                column.loading = False
+                self._building.discard(index)
+            await app.restore()
+        elif app.released:
+            await app.restore()
+
+    def _release_idle(self):
+        now = time.monotonic()
+        for app, hidden_since in zip(self.apps, self.hidden_since):
+            if app is not None and not app.released and hidden_since is not None \
+                    and now - hidden_since > self.idle_timeout:
+                app.release()
 
-    tabs = pn.Tabs(
-        ("Spleen", app1.panel()),
-        ("Kidney", app2.panel()),
-        ("Liver", app3.panel()),
-    )
+    def panel(self):
+        if self.idle_timeout > 0 and pn.state.curdoc is not None:
+            period = int(min(self.idle_timeout, 60) * 1000)
+            pn.state.add_periodic_callback(self._release_idle, period=period)
+        return self.tabs
+
+def create_tabs():
+    return LazyTabs(TISSUES).panel()
 
+# Main entry point
+def main():
     if (ENV_CHECK == "DEV"):
         port = 4603
     else:
         port = 80
   
-    pn.serve(tabs, port=port, websocket_origin=['*'])
+    if DIAGNOSTICS:
+        start_periodic_log()
+        serve_admin_page()
+    pn.serve(create_tabs, port=port, websocket_origin=['*'])
 
 if __name__ == "__main__":
     notify_webhook()
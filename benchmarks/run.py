@@ -0,0 +1,152 @@
+# benchmarks/run.py - wall time and peak memory per pipeline stage
+#
+# Run from the repository root:
+#   python -m benchmarks.run --compounds 1000 100000 --output bench.json
+#   python -m benchmarks.run --compare before.json after.json
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_export
+from column_mapper import extract_column_mapping, save_mapping
+from distCalc import compute_compound_distances
+from utils import load_and_prepare_data
+from volcano_plot import generate_plot
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CSV_FILE = "ReBench.csv"
+MAPPING_FILE = "ReBench_column_mapping.json"
+DISTANCE_FILE = "ReBench_by_distance_named.csv"
+
+def stages():
+    # (name, callable) in pipeline order; each stage reads files written by
+    # the ones before it, and the last two share the prepared frame
+    prepared = {}
+
+    def mapping():
+        save_mapping(extract_column_mapping(CSV_FILE), MAPPING_FILE)
+
+    def distances():
+        compute_compound_distances(CSV_FILE, MAPPING_FILE, output_csv=DISTANCE_FILE,
+                                   max_results=100, distance_threshold=np.inf)
+
+    def prepare():
+        prepared["df"], prepared["comparisons"] = load_and_prepare_data(CSV_FILE, DISTANCE_FILE, CSV_FILE)
+
+    def plot():
+        generate_plot(prepared["df"], 0, prepared["comparisons"])
+
+    return [
+        ("extract_column_mapping", mapping),
+        ("compute_compound_distances", distances),
+        ("load_and_prepare_data", prepare),
+        ("generate_plot", plot),
+    ]
+
+def measure(func, repeat):
+    # Best-of-N wall time without tracing, then one traced run for peak memory
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(times), "peak_bytes": peak}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(compound_counts, comparisons, noise, repeat):
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "comparisons": comparisons,
+            "noise": noise,
+            "repeat": repeat,
+        },
+        "runs": [],
+    }
+    cwd = os.getcwd()
+    for compounds in compound_counts:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            try:
+                generate_export(CSV_FILE, compounds, comparisons, noise)
+                run_result = {"compounds": compounds, "stages": {}}
+                for name, func in stages():
+                    run_result["stages"][name] = stats = measure(func, repeat)
+                    print(f"{compounds:>9,} compounds  {name:<28} "
+                          f"{stats['seconds']:9.3f} s  {stats['peak_bytes'] / 2**20:9.1f} MiB peak")
+                results["runs"].append(run_result)
+            finally:
+                os.chdir(cwd)
+    return results
+
+def compare(before_file, after_file):
+    with open(before_file) as f:
+        before = json.load(f)
+    with open(after_file) as f:
+        after = json.load(f)
+    print(f"{before['meta'].get('commit')} -> {after['meta'].get('commit')}")
+    old_runs = {run["compounds"]: run["stages"] for run in before["runs"]}
+    for run in after["runs"]:
+        old_stages = old_runs.get(run["compounds"])
+        if old_stages is None:
+            continue
+        for name, new in run["stages"].items():
+            old = old_stages.get(name)
+            if old is None:
+                continue
+            print(f"{run['compounds']:>9,} compounds  {name:<28} "
+                  f"time x{new['seconds'] / old['seconds']:6.2f}  "
+                  f"peak x{new['peak_bytes'] / max(old['peak_bytes'], 1):6.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages on synthetic exports.")
+    parser.add_argument("--compounds", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--comparisons", type=int, default=7)
+    parser.add_argument("--noise", type=float, default=0.01, help="Fraction of cells with dirty quoting.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write results as JSON to this file.")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="Print time/peak ratios between two result files instead of running.")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run(args.compounds, args.comparisons, args.noise, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to '{args.output}'")
+
+if __name__ == "__main__":
+    main()
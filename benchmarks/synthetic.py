@@ -0,0 +1,66 @@
+# benchmarks/synthetic.py - vendor-style export generator for benchmarks
+import argparse
+import csv
+
+import numpy as np
+import pandas as pd
+
+GROUPS = ["ctrl", "lps", "cla", "cla_lps", "no2-cla_lps", "no2-cla", "dex", "dex_lps"]
+
+def comparison_names(count):
+    # "(treatment) / (control)" pairs in the same form as the real exports
+    pairs = [(a, b) for b in GROUPS for a in GROUPS if a != b]
+    return [f"({a}) / ({b})" for a, b in pairs[:count]]
+
+def dirty(values, rng, noise):
+    # Wrap a `noise` fraction of cells in stray quotes and blank out a few,
+    # like the quoting artefacts in the vendor exports
+    values = pd.Series(values).astype(str)
+    if noise <= 0:
+        return values
+    roll = rng.random(len(values))
+    values = values.where(roll >= noise, '"' + values + '"')
+    return values.where(roll >= noise / 10, '""')
+
+def generate_export(path, compounds=1000, comparisons=5, noise=0.01, samples=10, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, compounds + 1)
+    mw = rng.uniform(80, 1200, compounds).round(5)
+
+    names = "Compound " + pd.Series(ids).astype(str)
+    names[rng.random(compounds) < 0.3] = ""  # unnamed features fall back to Formula
+
+    columns = {
+        "Checked": "FALSE",
+        "Compounds ID": ids,
+        "Name": dirty(names, rng, noise),
+        "Formula": dirty("C" + pd.Series(rng.integers(1, 40, compounds)).astype(str) +
+                         "H" + pd.Series(rng.integers(1, 80, compounds)).astype(str) + "O2", rng, noise),
+        "Annot. DeltaMass [ppm]": rng.normal(0, 2, compounds).round(3),
+        "Calc. MW": mw,
+        "m/z": (mw + 1.00728).round(5),
+        "RT [min]": rng.uniform(0.5, 20, compounds).round(3),
+    }
+    for name in comparison_names(comparisons):
+        p_values = rng.uniform(0, 1, compounds) ** 3
+        columns[f"Log2 Fold Change: {name}"] = dirty(rng.normal(0, 2, compounds), rng, noise)
+        columns[f"P-value: {name}"] = dirty(p_values, rng, noise)
+        columns[f"Adj. P-value: {name}"] = np.minimum(p_values * comparisons, 1)
+    for i in range(samples):
+        columns[f"Area: Sample {i + 1}"] = rng.lognormal(14, 1.5, compounds).round(1)
+
+    pd.DataFrame(columns).to_csv(path, index=False, encoding="latin1", quoting=csv.QUOTE_NONNUMERIC)
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic vendor-style export.")
+    parser.add_argument("output")
+    parser.add_argument("--compounds", type=int, default=1000)
+    parser.add_argument("--comparisons", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=0.01, help="Fraction of cells with dirty quoting.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    generate_export(args.output, args.compounds, args.comparisons, args.noise, seed=args.seed)
+
+if __name__ == "__main__":
+    main()
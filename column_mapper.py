@@ -1,14 +1,27 @@
 # column_mapper.py
 
-import pandas as pd
+import csv
+import os
 import re
 import json
 
+# Compiled once; the header scan runs them over every column of every export
+FOLD_CHANGE_PATTERN = re.compile(r"Log2 Fold Change: (.+)")
+P_VALUE_PATTERN = re.compile(r"(?<!Adj\.\s)P-value: (.+)")
+QUOTES_PATTERN = re.compile(r'["\\]')
+SPACES_PATTERN = re.compile(r'\s+')
+
 def clean_key(s: str) -> str:
-    s = re.sub(r'["\\]', '', s)
-    s = re.sub(r'\s+', ' ', s)
+    s = QUOTES_PATTERN.sub('', s)
+    s = SPACES_PATTERN.sub(' ', s)
     return s.strip()
 
+def read_header(csv_file) -> list:
+    # Only the first record is parsed, so mapping a large export does not
+    # need pandas or more than one line of the file
+    with open(csv_file, encoding='latin1', newline='') as f:
+        return next(csv.reader(f), [])
+
 def deep_clean(obj):
     if isinstance(obj, dict):
         return {k: deep_clean(v) for k, v in obj.items()}
@@ -23,23 +36,26 @@ def deep_clean(obj):
         return v.strip()
     return obj
 
-def extract_column_mapping(csv_file: str) -> dict:
-    df = pd.read_csv(csv_file, encoding='latin1', nrows=0)
-    columns = df.columns.tolist()
-
-    fold_change_pattern = r"Log2 Fold Change: (.+)"
-    p_value_pattern = r"(?<!Adj\.\s)P-value: (.+)"
+def extract_column_mapping(csv_file) -> dict:
+    # Accepts a path or an already parsed dataset.Dataset
+    if isinstance(csv_file, (str, os.PathLike)):
+        columns = read_header(csv_file)
+    else:
+        columns = csv_file.columns
+        csv_file = csv_file.path
 
-    fold_change_cols = {
-        clean_key(re.search(fold_change_pattern, col).group(1)): col.strip()
-        for col in columns if re.search(fold_change_pattern, col)
-    }
-    p_value_cols = {
-        clean_key(re.search(p_value_pattern, col).group(1)): col.strip()
-        for col in columns if re.search(p_value_pattern, col)
-    }
+    fold_change_cols = {}
+    p_value_cols = {}
+    for col in columns:
+        match = FOLD_CHANGE_PATTERN.search(col)
+        if match:
+            fold_change_cols[clean_key(match.group(1))] = col.strip()
+        match = P_VALUE_PATTERN.search(col)
+        if match:
+            p_value_cols[clean_key(match.group(1))] = col.strip()
 
-    matched_keys = set(fold_change_cols.keys()) & set(p_value_cols.keys())
+    # Keep header order so the mapping file is identical from run to run
+    matched_keys = [key for key in fold_change_cols if key in p_value_cols]
 
     entries = []
     for key in matched_keys:
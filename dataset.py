@@ -0,0 +1,98 @@
+# dataset.py
+import os
+import numpy as np
+import pandas as pd
+
+CSV_OPTIONS = dict(encoding="ISO-8859-1", sep=",", quotechar='"', on_bad_lines="skip")
+
+
+class Dataset:
+    # A vendor export parsed once and shared by the mapping, distance and plot
+    # stages. `df` keeps the raw header so each stage can clean it as before.
+    def __init__(self, path, df):
+        self.path = path
+        self.key = os.path.basename(path)
+        self.df = df
+
+    @property
+    def columns(self):
+        return self.df.columns.tolist()
+
+    def frame(self):
+        # Shallow copy: stages may rename or replace columns without touching
+        # the shared data.
+        return self.df.copy(deep=False)
+
+
+def load_dataset(path):
+    try:
+        df = pd.read_csv(path, engine="python", **CSV_OPTIONS)
+    except Exception as e:
+        raise RuntimeError(f"Error reading file '{path}': {e}")
+    return Dataset(path, df)
+
+
+def clean_column_name(name):
+    return str(name).strip().replace('"', '').replace("'", '')
+
+
+def projected_positions(path, columns):
+    # Raw header and the positions of `columns` in it, matched on cleaned names
+    # with the first occurrence winning
+    try:
+        header = pd.read_csv(path, nrows=0, **CSV_OPTIONS).columns
+    except pd.errors.ParserError:
+        header = pd.read_csv(path, nrows=0, engine="python", **CSV_OPTIONS).columns
+
+    positions, seen = [], set()
+    for i, name in enumerate(header):
+        name = clean_column_name(name)
+        if name in columns and name not in seen:
+            positions.append(i)
+            seen.add(name)
+    return header, positions
+
+
+def parse_numeric_text(series):
+    # Quote-stripped text to float64; unparsable values become NaN
+    text = series.astype(str).str.strip().str.strip('"\'').str.strip()
+    return pd.to_numeric(text, errors='coerce').astype(np.float64)
+
+
+def read_projected_csv(path, columns, numeric_columns=()):
+    # Read only `columns` (matched on cleaned header names, first occurrence wins)
+    # with the C parser, in a single pass. Text columns are read as str; numeric
+    # columns are left to type inference, so clean ones arrive as numbers and
+    # only those holding quoted or dirty values are parsed again column by column.
+    # Only a file the C tokenizer rejects goes through the tolerant Python parser.
+    header, positions = projected_positions(path, columns)
+    numeric = {header[i] for i in positions if clean_column_name(header[i]) in numeric_columns}
+    text_dtypes = {header[i]: str for i in positions if header[i] not in numeric}
+
+    try:
+        df = pd.read_csv(path, usecols=positions, dtype=text_dtypes, **CSV_OPTIONS)
+    except pd.errors.ParserError:
+        print(f"[INFO] C parser failed on '{path}', falling back to the Python parser.")
+        df = pd.read_csv(path, engine="python", usecols=positions, dtype=text_dtypes, **CSV_OPTIONS)
+
+    for name in numeric:
+        if not pd.api.types.is_numeric_dtype(df[name]):
+            df[name] = parse_numeric_text(df[name])
+    return df
+
+
+def iter_projected_csv(path, columns, chunksize, dtype=str, engine="c"):
+    # Chunked counterpart of read_projected_csv for files that do not fit in
+    # memory. Chunks come back with cleaned column names; a dict `dtype` is keyed
+    # on cleaned names too. There is no mid-stream fallback, so callers restart
+    # with engine="python" if the C parser raises ParserError.
+    header, positions = projected_positions(path, columns)
+    if isinstance(dtype, dict):
+        dtype = {header[i]: dtype[clean_column_name(header[i])]
+                 for i in positions if clean_column_name(header[i]) in dtype}
+
+    with pd.read_csv(path, engine=engine, usecols=positions, dtype=dtype,
+                     chunksize=chunksize, **CSV_OPTIONS) as reader:
+        for chunk in reader:
+            chunk.columns = [clean_column_name(name) for name in chunk.columns]
+            yield chunk
@@ -0,0 +1,193 @@
+# diagnostics.py - opt-in memory and object accounting for the Panel server
+import gc
+import hashlib
+import os
+import time
+import tracemalloc
+import weakref
+
+import panel as pn
+from plotly.basedatatypes import BaseFigure
+
+# DIAGNOSTICS=1 turns on tracemalloc, a periodic "[DIAG]" log and the
+# /admin/memory page; the interval is in seconds. The page is served on its
+# own port bound to 127.0.0.1 (reach it through an SSH tunnel), and repeated
+# loads within DIAGNOSTICS_MIN_INTERVAL seconds reuse the last snapshot.
+DIAGNOSTICS = os.environ.get("DIAGNOSTICS", "0") == "1"
+DIAGNOSTICS_INTERVAL = int(os.environ.get("DIAGNOSTICS_INTERVAL", "300"))
+DIAGNOSTICS_PORT = int(os.environ.get("DIAGNOSTICS_PORT", "4604"))
+DIAGNOSTICS_MIN_INTERVAL = float(os.environ.get("DIAGNOSTICS_MIN_INTERVAL", "30"))
+TRACEMALLOC_FRAMES = int(os.environ.get("TRACEMALLOC_FRAMES", "1"))
+TOP_ALLOCATORS = 10
+
+_apps = weakref.WeakSet()
+
+def track_app(app):
+    _apps.add(app)
+
+def current_session_id():
+    doc = pn.state.curdoc
+    if doc is None or doc.session_context is None:
+        return None
+    return doc.session_context.id
+
+def session_label(session_id):
+    # Session IDs grant access to the session, so only a short hash is shown
+    if session_id is None:
+        return "-"
+    return hashlib.sha256(session_id.encode()).hexdigest()[:12]
+
+def rss_bytes():
+    # Current resident set size; falls back to the peak where /proc is missing
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def frame_bytes(df):
+    return 0 if df is None else int(df.memory_usage(deep=True).sum())
+
+def count_live_figures():
+    gc.collect()
+    return sum(isinstance(obj, BaseFigure) for obj in gc.get_objects())
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:,.1f} {unit}"
+        n /= 1024
+
+class MemoryMonitor:
+    # Takes snapshots of RSS, live figures, per-session VolcanoApp data and the
+    # top tracemalloc allocators, reporting growth since the previous snapshot.
+    def __init__(self, top=TOP_ALLOCATORS):
+        self.top = top
+        self.previous = None
+        self._previous_trace = None
+        self._report = None
+        self._report_time = None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def snapshot(self):
+        sessions = {}
+        frames_seen = {}
+
+        def shared_bytes(df):
+            # A frame shared through the dataset store (the prepared data or a
+            # cached table order) is only counted once
+            if id(df) not in frames_seen:
+                frames_seen[id(df)] = frame_bytes(df)
+            return frames_seen[id(df)]
+
+        for app in list(_apps):
+            sessions.setdefault(session_label(app.session_id), []).append({
+                "data_file": app.data_file,
+                "df_bytes": shared_bytes(app.df),
+                "table_bytes": shared_bytes(app.table.value),
+                "cached_figures": len(app.figure_cache),
+                "released": app.released,
+            })
+
+        trace = tracemalloc.take_snapshot()
+        if self._previous_trace is None:
+            top = trace.statistics("lineno")[:self.top]
+        else:
+            top = trace.compare_to(self._previous_trace, "lineno")[:self.top]
+        self._previous_trace = trace
+
+        snapshot = {
+            "time": time.time(),
+            "rss": rss_bytes(),
+            "figures": count_live_figures(),
+            "apps": len(_apps),
+            "shared_frame_bytes": sum(frames_seen.values()),
+            "sessions": sessions,
+            "top": top,
+        }
+        previous, self.previous = self.previous, snapshot
+        snapshot["delta"] = None if previous is None else {
+            key: snapshot[key] - previous[key]
+            for key in ("rss", "figures", "apps", "shared_frame_bytes")
+        }
+        return snapshot
+
+    def report(self):
+        snap = self.snapshot()
+        delta = snap["delta"]
+
+        def since(key, fmt):
+            return f" ({fmt(delta[key])} since last)" if delta else ""
+
+        lines = [
+            f"RSS: {format_bytes(snap['rss'])}{since('rss', format_bytes)}",
+            f"Live Plotly figures: {snap['figures']}{since('figures', '{:+d}'.format)}",
+            f"VolcanoApp instances: {snap['apps']}{since('apps', '{:+d}'.format)}",
+            f"Shared frames: {format_bytes(snap['shared_frame_bytes'])}"
+            f"{since('shared_frame_bytes', format_bytes)}",
+        ]
+        for session_id, apps in sorted(snap["sessions"].items()):
+            lines.append(f"Session {session_id}:")
+            for app in apps:
+                state = "released" if app["released"] else f"{app['cached_figures']} cached figures"
+                lines.append(f"  {app['data_file']}: df {format_bytes(app['df_bytes'])}, "
+                             f"table {format_bytes(app['table_bytes'])}, {state}")
+        title = "Top allocators" if snap["delta"] is None else "Top allocation growth"
+        lines.append(f"{title}:")
+        lines.extend(f"  {stat}" for stat in snap["top"])
+        return "\n".join(lines)
+
+    def cached_report(self, min_interval=DIAGNOSTICS_MIN_INTERVAL):
+        # The last report if it is younger than min_interval seconds, so
+        # reloading the page cannot trigger back-to-back gc and tracemalloc passes
+        now = time.monotonic()
+        if self._report is None or now - self._report_time >= min_interval:
+            self._report, self._report_time = self.report(), now
+        return self._report
+
+    def log(self):
+        print("[DIAG] " + self.report().replace("\n", "\n[DIAG] "))
+
+_monitor = None
+
+def get_monitor():
+    global _monitor
+    if _monitor is None:
+        _monitor = MemoryMonitor()
+    return _monitor
+
+def start_periodic_log(interval=DIAGNOSTICS_INTERVAL):
+    pn.state.schedule_task("memory-diagnostics", get_monitor().log, period=f"{interval}s")
+
+_admin_monitor = None
+
+def admin_page():
+    # One monitor for all page loads, separate from the periodic log's so
+    # page refreshes do not reset its deltas
+    global _admin_monitor
+    if _admin_monitor is None:
+        _admin_monitor = MemoryMonitor()
+    report = pn.pane.Markdown(sizing_mode="stretch_width")
+    refresh = pn.widgets.Button(name="Take snapshot", button_type="primary")
+
+    def update(event=None):
+        report.object = f"```\n{_admin_monitor.cached_report()}\n```"
+
+    refresh.on_click(update)
+    update()
+    return pn.Column("## Memory diagnostics", refresh, report, sizing_mode="stretch_width")
+
+def serve_admin_page(port=DIAGNOSTICS_PORT):
+    # Localhost-only server on the current IO loop; the public app's own
+    # pn.serve call runs the loop. start() installs the session cleanup
+    # callbacks without blocking, so closed admin sessions are discarded.
+    origins = [f"127.0.0.1:{port}", f"localhost:{port}"]
+    server = pn.serve({'/admin/memory': admin_page}, port=port, address="127.0.0.1",
+                      websocket_origin=origins, show=False, start=False)
+    server.start()
+    return server
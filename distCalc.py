@@ -1,15 +1,23 @@
 import pandas as pd
 import numpy as np
 import json
-from collections import defaultdict
 import os
+import hashlib
+import threading
+from collections import OrderedDict
+from dataset import Dataset, load_dataset, clean_column_name, projected_positions, iter_projected_csv
+
+MAPPING_COLUMNS = ['Compounds ID', 'Name', 'Formula', 'Calc. MW']
 
 def clean_column_names(columns):
     return columns.str.strip().str.replace('"', '', regex=False).str.replace("'", '', regex=False)
 
-def clean_numeric_column(series, col_name):
+def parse_numeric(series, col_name=None):
     cleaned = series.astype(str).str.strip().str.strip('"').str.strip()
-    numeric = pd.to_numeric(cleaned, errors='coerce')
+    return pd.to_numeric(cleaned, errors='coerce')
+
+def clean_numeric_column(series, col_name):
+    numeric = parse_numeric(series)
     num_non_numeric = numeric.isna().sum()
     if num_non_numeric == len(series):
         print(f"\nWARNING: ALL VALUES in column '{col_name}' failed numeric conversion!")
@@ -28,86 +36,359 @@ def strip_nested_quotes(val):
         val = val[1:-1].strip()
     return val if val else np.nan
 
-def compute_compound_distances(file: str,
+# Fold changes and -log10(p-values) of every row as rows x comparisons matrices.
+# Comparisons whose columns are missing stay NaN.
+def comparison_values(df, comparisons, parse=clean_numeric_column, verbose=True):
+    x = np.full((len(df), len(comparisons)), np.nan)
+    y = np.full((len(df), len(comparisons)), np.nan)
+    for j, (log2fc_col, pval_col) in enumerate(comparisons):
+        if verbose:
+            print(f"\n[DEBUG] Processing comparison: {log2fc_col} vs {pval_col}")
+        if log2fc_col not in df.columns or pval_col not in df.columns:
+            if verbose:
+                print(f"[WARNING] Skipping comparison: Missing column(s): '{log2fc_col}' or '{pval_col}'")
+            continue
+
+        pvals = parse(df[pval_col], pval_col)
+        x[:, j] = parse(df[log2fc_col], log2fc_col).to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            y[:, j] = -np.log10(pvals.to_numpy(dtype=float))
+
+    valid = ~np.isnan(x) & ~np.isnan(y) & df['Compounds ID'].notna().to_numpy()[:, None]
+    return x, y, valid
+
+def report_empty_comparisons(comparisons, columns, has_data):
+    for j in np.flatnonzero(~has_data):
+        log2fc_col, pval_col = comparisons[j]
+        if log2fc_col in columns and pval_col in columns:
+            print(f"[WARNING] No valid data found for comparison '{log2fc_col}' vs '{pval_col}'. Skipping.")
+
+# Per-comparison leftmost and rightmost fold change and topmost -log10(p-value)
+def corner_extrema(x, y, valid):
+    return (np.min(x, axis=0, initial=np.inf, where=valid),
+            np.max(x, axis=0, initial=-np.inf, where=valid),
+            np.max(y, axis=0, initial=-np.inf, where=valid))
+
+def corner_distances(x, y, valid, extrema):
+    leftmost_x, rightmost_x, topmost_y = extrema
+    with np.errstate(invalid='ignore'):
+        corner_x = np.where(x < 0, leftmost_x, rightmost_x)
+        distances = np.sqrt((x - corner_x) ** 2 + (y - topmost_y) ** 2)
+    distances[~valid] = np.nan
+    return distances
+
+# Distance of every row to its volcano corner as a rows x comparisons matrix.
+# A cell is valid when the row has a compound ID, fold change and -log10(p-value).
+def compute_distance_matrix(df, comparisons):
+    x, y, valid = comparison_values(df, comparisons)
+    report_empty_comparisons(comparisons, df.columns, valid.any(axis=0))
+    return corner_distances(x, y, valid, corner_extrema(x, y, valid)), valid
+
+# Inverse-variance weighted average of each compound's valid distances, with rows
+# sharing a compound ID pooled and compounds ordered by first appearance.
+def aggregate_distances(compound_ids, distances, valid):
+    has_data = valid.any(axis=1)
+    rows = np.flatnonzero(has_data)
+    codes, uniques = pd.factorize(pd.Series(compound_ids).iloc[rows])
+    n_compounds = len(uniques)
+
+    row_valid = valid[rows]
+    row_distances = np.where(row_valid, distances[rows], 0.0)
+    counts = np.bincount(codes, weights=row_valid.sum(axis=1), minlength=n_compounds)
+    sums = np.bincount(codes, weights=row_distances.sum(axis=1), minlength=n_compounds)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = sums / counts
+        deviations = np.where(row_valid, (distances[rows] - mean[codes][:, None]) ** 2, 0.0)
+        var = np.bincount(codes, weights=deviations.sum(axis=1), minlength=n_compounds) / counts
+        weights = 1 / var
+        weighted_sums = np.bincount(codes, weights=(row_distances * weights[codes][:, None]).sum(axis=1),
+                                    minlength=n_compounds)
+        weight_totals = np.bincount(codes, weights=row_valid.sum(axis=1) * weights[codes], minlength=n_compounds)
+        weighted = weighted_sums / weight_totals
+
+    final = np.where(counts == 1, sums, np.where(var == 0, mean, weighted))
+
+    first_comparison = np.argmax(row_valid, axis=1)
+    first_seen = np.full(n_compounds, np.iinfo(np.int64).max)
+    np.minimum.at(first_seen, codes, first_comparison * len(valid) + rows)
+    order = np.argsort(first_seen, kind='stable')
+
+    return pd.Series(final[order], index=pd.Index(uniques).take(order), name='Total Distance')
+
+# The k compounds nearest their corners with distance below `threshold`,
+# nearest first. A partial selection finds the k-th distance in O(n), so only
+# the k winners are sorted; ties keep first-seen order.
+def nearest_compounds(compound_distances, k=None, threshold=np.inf):
+    values = compound_distances.to_numpy(dtype=float)
+    candidates = np.flatnonzero(values < threshold)
+    if k is not None and k < len(candidates):
+        if k <= 0:
+            return compound_distances.iloc[:0]
+        kth = np.partition(values[candidates], k - 1)[k - 1]
+        below = candidates[values[candidates] < kth]
+        ties = candidates[values[candidates] == kth][:k - len(below)]
+        candidates = np.sort(np.concatenate([below, ties]))
+    return compound_distances.iloc[candidates[np.argsort(values[candidates], kind='stable')]]
+
+# compute_distance_matrix + aggregate_distances for data that is already loaded
+# and parsed: compounds x comparisons arrays of fold changes and raw p-values,
+# such as a prepared dataset's ComparisonArrays. No parsing, printing or files.
+def array_distances(compound_ids, fold_change, p_values):
+    compound_ids = pd.Series(compound_ids).reset_index(drop=True)
+    x = np.asarray(fold_change, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = -np.log10(np.asarray(p_values, dtype=float))
+    valid = ~np.isnan(x) & ~np.isnan(y) & compound_ids.notna().to_numpy()[:, None]
+    distances = corner_distances(x, y, valid, corner_extrema(x, y, valid))
+    return aggregate_distances(compound_ids, distances, valid)
+
+def array_hash(compound_ids, *arrays):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(pd.util.hash_pandas_object(pd.Series(compound_ids), index=False).to_numpy().tobytes())
+    for array in arrays:
+        digest.update(str(array.shape).encode())
+        digest.update(np.asarray(array).tobytes())
+    return digest.hexdigest()
+
+# In-process memo for array_distances. Per-compound totals are kept per
+# (dataset hash, comparisons) and the nearest compounds per (dataset hash,
+# comparisons, threshold, k), so only the first call on a dataset does the
+# distance pass and a new threshold or k is one O(n) selection.
+class DistanceMemo:
+    def __init__(self, maxsize=4, selections=64):
+        self.maxsize = maxsize
+        self.selections = selections
+        self._totals = OrderedDict()
+        self._nearest = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, store, key):
+        with self._lock:
+            value = store.get(key)
+            if value is not None:
+                store.move_to_end(key)
+            return value
+
+    def _put(self, store, key, value, maxsize):
+        with self._lock:
+            store[key] = value
+            store.move_to_end(key)
+            while len(store) > maxsize:
+                store.popitem(last=False)
+
+    def nearest(self, compound_ids, fold_change, p_values, comparisons,
+                distance_threshold=12, max_results=100, dataset_hash=None):
+        # `comparisons` names the (fold change, p-value) columns of the arrays;
+        # pass `dataset_hash` to skip hashing the data on every call
+        if dataset_hash is None:
+            dataset_hash = array_hash(compound_ids, fold_change, p_values)
+        totals_key = (dataset_hash, tuple(map(tuple, comparisons)))
+        key = totals_key + (float(distance_threshold), max_results)
+
+        nearest = self._get(self._nearest, key)
+        if nearest is None:
+            totals = self._get(self._totals, totals_key)
+            if totals is None:
+                totals = array_distances(compound_ids, fold_change, p_values)
+                self._put(self._totals, totals_key, totals, self.maxsize)
+            nearest = nearest_compounds(totals, max_results, distance_threshold)
+            self._put(self._nearest, key, nearest, self.selections)
+        return nearest
+
+    def clear(self):
+        with self._lock:
+            self._totals.clear()
+            self._nearest.clear()
+
+DISTANCES = DistanceMemo()
+
+# Streaming stand-in for clean_numeric_column: parses quietly and tallies
+# non-numeric entries per column so each warning is printed once per file.
+class NonNumericTally:
+    def __init__(self):
+        self.rows = {}
+        self.failed = {}
+        self.samples = {}
+
+    def __call__(self, series, col_name):
+        numeric = parse_numeric(series)
+        failed = numeric.isna()
+        self.rows[col_name] = self.rows.get(col_name, 0) + len(series)
+        self.failed[col_name] = self.failed.get(col_name, 0) + int(failed.sum())
+        samples = self.samples.setdefault(col_name, [])
+        for value in series[failed].dropna().unique():
+            if len(samples) >= 5:
+                break
+            if value not in samples:
+                samples.append(value)
+        return numeric
+
+    def report(self):
+        for col_name, failed in self.failed.items():
+            samples = np.array(self.samples[col_name], dtype=object)
+            if failed == self.rows[col_name]:
+                print(f"\nWARNING: ALL VALUES in column '{col_name}' failed numeric conversion!")
+                print(f"Sample values: {samples}")
+            elif failed > 0:
+                print(f"\nWARNING: {failed} non-numeric entries detected in column '{col_name}'")
+                print(f"Sample values: {samples}")
+
+# Running per-compound state for streaming: one slot per compound ID with the
+# count and sum of its valid distances and the key it was first seen at.
+class DistanceAccumulator:
+    # Larger than any row count, so first-seen keys sort by comparison, then row
+    ROW_STRIDE = 2 ** 40
+
+    def __init__(self):
+        self.slots = {}
+        self.counts = np.zeros(0)
+        self.sums = np.zeros(0)
+        self.first_seen = np.zeros(0, dtype=np.int64)
+
+    def _reserve(self, size):
+        if size <= len(self.counts):
+            return
+        pad = max(size, 2 * len(self.counts), 1024) - len(self.counts)
+        self.counts = np.concatenate([self.counts, np.zeros(pad)])
+        self.sums = np.concatenate([self.sums, np.zeros(pad)])
+        self.first_seen = np.concatenate([self.first_seen, np.full(pad, np.iinfo(np.int64).max)])
+
+    def add(self, compound_ids, distances, valid, row_offset):
+        rows = np.flatnonzero(valid.any(axis=1))
+        if not len(rows):
+            return
+        codes, uniques = pd.factorize(pd.Series(compound_ids).iloc[rows])
+        slots = np.array([self.slots.setdefault(key, len(self.slots)) for key in uniques])
+        self._reserve(len(self.slots))
+
+        row_valid = valid[rows]
+        row_distances = np.where(row_valid, distances[rows], 0.0)
+        self.counts[slots] += np.bincount(codes, weights=row_valid.sum(axis=1), minlength=len(uniques))
+        self.sums[slots] += np.bincount(codes, weights=row_distances.sum(axis=1), minlength=len(uniques))
+
+        keys = np.argmax(row_valid, axis=1) * self.ROW_STRIDE + row_offset + rows
+        first_seen = np.full(len(uniques), np.iinfo(np.int64).max)
+        np.minimum.at(first_seen, codes, keys)
+        self.first_seen[slots] = np.minimum(self.first_seen[slots], first_seen)
+
+    def result(self):
+        # Every distance of a compound gets the same inverse-variance weight, so
+        # the weighted average of aggregate_distances is the mean: count and sum
+        # are all the state that has to be kept.
+        n_compounds = len(self.slots)
+        final = self.sums[:n_compounds] / self.counts[:n_compounds]
+        order = np.argsort(self.first_seen[:n_compounds], kind='stable')
+        return pd.Series(final[order], index=pd.Index(list(self.slots)).take(order), name='Total Distance')
+
+def stream_extrema(path, comparisons, chunksize, engine="c"):
+    columns = {'Compounds ID'} | {col for pair in comparisons for col in pair}
+    tally = NonNumericTally()
+    leftmost = np.full(len(comparisons), np.inf)
+    rightmost = np.full(len(comparisons), -np.inf)
+    topmost = np.full(len(comparisons), -np.inf)
+    has_data = np.zeros(len(comparisons), dtype=bool)
+    present = set()
+    for i, chunk in enumerate(iter_projected_csv(path, columns, chunksize, engine=engine)):
+        present = set(chunk.columns)
+        x, y, valid = comparison_values(chunk, comparisons, parse=tally, verbose=(i == 0))
+        left, right, top = corner_extrema(x, y, valid)
+        np.minimum(leftmost, left, out=leftmost)
+        np.maximum(rightmost, right, out=rightmost)
+        np.maximum(topmost, top, out=topmost)
+        has_data |= valid.any(axis=0)
+    tally.report()
+    report_empty_comparisons(comparisons, present, has_data)
+    return leftmost, rightmost, topmost
+
+# Out-of-core version of compute_distance_matrix + aggregate_distances: a first
+# pass over the export collects the corner extrema, a second computes distances
+# chunk by chunk into a DistanceAccumulator. Returns the totals and the parser
+# engine that worked, for any further passes.
+def stream_compound_distances(path, comparisons, chunksize):
+    engine = "c"
+    try:
+        extrema = stream_extrema(path, comparisons, chunksize, engine)
+    except pd.errors.ParserError:
+        print(f"[INFO] C parser failed on '{path}', falling back to the Python parser.")
+        engine = "python"
+        extrema = stream_extrema(path, comparisons, chunksize, engine)
+
+    columns = {'Compounds ID'} | {col for pair in comparisons for col in pair}
+    accumulator = DistanceAccumulator()
+    row_offset = 0
+    for chunk in iter_projected_csv(path, columns, chunksize, engine=engine):
+        x, y, valid = comparison_values(chunk, comparisons, parse=parse_numeric, verbose=False)
+        accumulator.add(chunk['Compounds ID'], corner_distances(x, y, valid, extrema), valid, row_offset)
+        row_offset += len(chunk)
+    return accumulator.result(), engine
+
+# Name/formula/MW rows of `compound_ids` only, read in chunks
+def stream_mapping(path, compound_ids, chunksize, engine="c"):
+    header, _ = projected_positions(path, MAPPING_COLUMNS)
+    missing = set(MAPPING_COLUMNS) - {clean_column_name(name) for name in header}
+    if missing:
+        raise ValueError(f"Missing required columns in mapping file: {missing}")
+
+    parts = []
+    if compound_ids:
+        for chunk in iter_projected_csv(path, set(MAPPING_COLUMNS), chunksize,
+                                        dtype={'Compounds ID': str}, engine=engine):
+            rows = chunk['Compounds ID'].isin(compound_ids)
+            if rows.any():
+                parts.append(chunk.loc[rows, MAPPING_COLUMNS].drop_duplicates())
+    if not parts:
+        return pd.DataFrame(columns=MAPPING_COLUMNS)
+    return pd.concat(parts, ignore_index=True).drop_duplicates()
+
+def compute_compound_distances(file,
                                mapping_file: str = "column_mapping.json",
                                output_csv: str = "by_distance_named.csv",
                                max_results: int = 100,
-                               distance_threshold: float = 12) -> pd.DataFrame:
+                               distance_threshold: float = 12,
+                               chunksize: int = None) -> pd.DataFrame:
     
     
     with open(mapping_file, "r") as f:
         column_mapping = json.load(f)
 
+    dataset = file if isinstance(file, Dataset) else None
+    file = dataset.path if dataset else file
     file_key = os.path.basename(file)
     entries = column_mapping.get(file_key, [])
     if not entries:
         print(f"[INFO] No comparisons found in mapping for '{file_key}'. Skipping.")
         return pd.DataFrame()
 
-    try:
-        df = pd.read_csv(file, encoding="ISO-8859-1", engine="python", sep=",", quotechar='"', on_bad_lines="skip")
-    except Exception as e:
-        raise RuntimeError(f"Error reading file '{file}': {e}")
-
-    df.columns = clean_column_names(df.columns)
-    print(f"\n[DEBUG] Number of columns read from '{file}': {len(df.columns)}")
-
     comparisons = []
     for entry in entries:
         fc = entry["fold_change_col"].strip().replace('"', '').replace("'", "")
         pv = entry["p_value_col"].strip().replace('"', '').replace("'", "")
         comparisons.append((fc, pv))
 
-    compound_distances = defaultdict(list)
-
-    for log2fc_col, pval_col in comparisons:
-        print(f"\n[DEBUG] Processing comparison: {log2fc_col} vs {pval_col}")
-        if log2fc_col not in df.columns or pval_col not in df.columns:
-            print(f"[WARNING] Skipping comparison: Missing column(s): '{log2fc_col}' or '{pval_col}'")
-            continue
+    if chunksize and dataset is None:
+        # Streaming: memory is bounded by the chunk size and the per-compound
+        # totals, and names are only looked up for the selected compounds
+        print(f"\n[DEBUG] Streaming '{file}' in chunks of {chunksize} rows")
+        compound_distances, engine = stream_compound_distances(file, comparisons, chunksize)
+        compound_distance_df = nearest_compounds(compound_distances, max_results, distance_threshold).to_frame()
+        mapping = stream_mapping(file, set(compound_distance_df.index), chunksize, engine)
+    else:
+        if dataset is None:
+            dataset = load_dataset(file)
+        df = dataset.frame()
+        df.columns = clean_column_names(df.columns)
+        print(f"\n[DEBUG] Number of columns read from '{file}': {len(df.columns)}")
 
-        df[pval_col] = clean_numeric_column(df[pval_col], pval_col)
-        df[log2fc_col] = clean_numeric_column(df[log2fc_col], log2fc_col)
-        df['-log10(p-value)'] = -np.log10(df[pval_col])
-        valid_df = df.dropna(subset=[log2fc_col, '-log10(p-value)', 'Compounds ID'])
+        distances, valid = compute_distance_matrix(df, comparisons)
+        compound_distances = aggregate_distances(df['Compounds ID'], distances, valid)
+        compound_distance_df = nearest_compounds(compound_distances, max_results, distance_threshold).to_frame()
 
-        if valid_df.empty:
-            print(f"[WARNING] No valid data found for comparison '{log2fc_col}' vs '{pval_col}'. Skipping.")
-            continue
-
-        leftmost_x = valid_df[log2fc_col].min()
-        rightmost_x = valid_df[log2fc_col].max()
-        topmost_y = valid_df['-log10(p-value)'].max()
-
-        for _, row in valid_df.iterrows():
-            x = row[log2fc_col]
-            y = row['-log10(p-value)']
-            compound_id = row['Compounds ID']
-            distance = np.sqrt((x - (leftmost_x if x < 0 else rightmost_x)) ** 2 + (y - topmost_y) ** 2)
-            compound_distances[compound_id].append(distance)
-
-    final_distances = {}
-    for compound_id, distances in compound_distances.items():
-        distances = np.array(distances)
-        if len(distances) > 1 and np.var(distances) == 0:
-            final_distance = np.mean(distances)
-        elif len(distances) > 1:
-            final_distance = np.average(distances, weights=np.full_like(distances, 1 / np.var(distances)))
-        else:
-            final_distance = distances[0]
-        final_distances[compound_id] = final_distance
-
-    compound_distance_df = pd.DataFrame.from_dict(final_distances, orient='index', columns=['Total Distance'])
-
-    mapping_df = pd.read_csv(file, encoding="ISO-8859-1", engine="python", sep=",", quotechar='"', on_bad_lines="skip")
-    mapping_df.columns = clean_column_names(mapping_df.columns)
-
-    required_cols = {'Compounds ID', 'Name', 'Formula', 'Calc. MW'}
-    missing = required_cols - set(mapping_df.columns)
-    if missing:
-        raise ValueError(f"Missing required columns in mapping file: {missing}")
+        missing = set(MAPPING_COLUMNS) - set(df.columns)
+        if missing:
+            raise ValueError(f"Missing required columns in mapping file: {missing}")
+        mapping = df[MAPPING_COLUMNS].drop_duplicates()
 
-    mapping = mapping_df[['Compounds ID', 'Name', 'Formula', 'Calc. MW']].drop_duplicates()
     for col in ['Name', 'Formula', 'Calc. MW']:
         mapping[col] = mapping[col].apply(strip_nested_quotes)
     mapping['Name'] = mapping['Name'].fillna(mapping['Formula']).fillna(mapping['Calc. MW'])
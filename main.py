@@ -1,7 +1,13 @@
 import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from column_mapper import extract_column_mapping, save_mapping
-from distCalc import compute_compound_distances
-from ModularVolcanos import generate_volcano_plot
+from manifest import MANIFEST_FILE, STAGE_VERSIONS, file_sha256, load_manifest, save_manifest, is_up_to_date, stage_record
+
+# pandas (dataset, distCalc) and plotly (ModularVolcanos) are imported inside
+# the stages that use them, so runs where every stage is up to date, or that
+# only build mappings, start without loading them.
 
 def is_valid_csv(filename):
     return (
@@ -10,31 +16,112 @@ def is_valid_csv(filename):
         "_" not in os.path.splitext(filename)[0]
     )
 
-def main():
-    csv_files = [f for f in os.listdir(".") if is_valid_csv(f)]
-
-    if not csv_files:
-        print("❌ No valid CSV files found in the current directory.")
-        return
+def process_csv(csv_file, previous=None, params=None, force=False, chunksize=None):
+    previous = {} if force or previous is None else previous
+    params = params or {}
+    base_name = os.path.splitext(csv_file)[0]
+    mapping_file = f"{base_name}_column_mapping.json"
+    distance_file = f"{base_name}_by_distance_named.csv"
+    #plot_file = f"{base_name}_volcano_plot.html"
 
-    for csv_file in csv_files:
-        base_name = os.path.splitext(csv_file)[0]
-        mapping_file = f"{base_name}_column_mapping.json"
-        distance_file = f"{base_name}_by_distance_named.csv"
-        #plot_file = f"{base_name}_volcano_plot.html"
+    # Parse the export lazily, once, and only if the distance stage needs it
+    csv_hash = file_sha256(csv_file)
+    dataset = None
 
-        # Step 1: Generate mapping
+    # Step 1: Generate mapping (header only)
+    mapping_inputs = {"version": STAGE_VERSIONS["mapping"], "csv_sha256": csv_hash}
+    if is_up_to_date(previous.get("mapping"), mapping_inputs):
+        print(f"⏭️  Mapping for '{csv_file}' is up to date: {mapping_file}")
+    else:
         mapping = extract_column_mapping(csv_file)
         save_mapping(mapping, mapping_file)
         print(f"✅ Cleaned and saved mapping for '{csv_file}' to: {mapping_file}")
 
-        # Step 2: Compute distances
-        compute_compound_distances(csv_file, mapping_file, output_csv=distance_file)
+    # Step 2: Compute distances
+    distance_inputs = {"version": STAGE_VERSIONS["distances"], "csv_sha256": csv_hash,
+                       "mapping_sha256": file_sha256(mapping_file), "params": params}
+    if is_up_to_date(previous.get("distances"), distance_inputs):
+        print(f"⏭️  Distances for '{csv_file}' are up to date: {distance_file}")
+    else:
+        from distCalc import compute_compound_distances
+        if chunksize:
+            # Streaming runs never hold the whole export
+            dataset = csv_file
+        else:
+            from dataset import load_dataset
+            dataset = load_dataset(csv_file)
+        compute_compound_distances(dataset, mapping_file, output_csv=distance_file, chunksize=chunksize, **params)
         print(f"✅ Distance computation complete for '{csv_file}'.")
 
-        # Step 3: Generate volcano plot
-        #generate_volcano_plot(csv_file, mapping_file, distance_file, plot_file)
-        #print(f"✅ Volcano plot saved to '{plot_file}'.")
+    # Step 3: Generate volcano plot
+    #from ModularVolcanos import generate_volcano_plot
+    #generate_volcano_plot(dataset, mapping_file, distance_file, plot_file)
+    #print(f"✅ Volcano plot saved to '{plot_file}'.")
+
+    return {
+        "mapping": stage_record(mapping_inputs, [mapping_file]),
+        "distances": stage_record(distance_inputs, [distance_file]),
+    }
+
+def run_csv(csv_file, previous=None, params=None, force=False, chunksize=None):
+    # Worker entry point: report failures instead of raising so one bad
+    # tissue does not take down the rest of the batch.
+    try:
+        return csv_file, None, process_csv(csv_file, previous, params, force, chunksize)
+    except Exception as e:
+        return csv_file, f"{type(e).__name__}: {e}", None
+    finally:
+        sys.stdout.flush()
+
+def print_summary(results):
+    print("\nSummary:")
+    for csv_file, error, _ in results:
+        if error is None:
+            print(f"  ✅ {csv_file}")
+        else:
+            print(f"  ❌ {csv_file}: {error}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build column mappings and distance tables for Re*.csv exports.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of files to process in parallel worker processes (default: 1).")
+    parser.add_argument("--distance-threshold", type=float, default=12,
+                        help="Only keep compounds closer than this total distance (default: 12).")
+    parser.add_argument("--max-results", type=int, default=100,
+                        help="Maximum number of compounds written per file (default: 100).")
+    parser.add_argument("--chunksize", type=int,
+                        help="Stream each export in chunks of this many rows instead of loading it whole.")
+    parser.add_argument("--force", action="store_true",
+                        help=f"Ignore {MANIFEST_FILE} and rebuild every stage.")
+    args = parser.parse_args(argv)
+
+    csv_files = sorted(f for f in os.listdir(".") if is_valid_csv(f))
+
+    if not csv_files:
+        print("❌ No valid CSV files found in the current directory.")
+        return []
+
+    manifest = load_manifest()
+    params = {"distance_threshold": args.distance_threshold, "max_results": args.max_results}
+    jobs = [(csv_file, manifest.get(csv_file), params, args.force, args.chunksize) for csv_file in csv_files]
+
+    if args.jobs > 1 and len(csv_files) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(csv_files))) as pool:
+            results = list(pool.map(run_csv, *zip(*jobs)))
+    else:
+        results = [run_csv(*job) for job in jobs]
+
+    for csv_file, error, entry in results:
+        if entry is not None:
+            manifest[csv_file] = entry
+        else:
+            manifest.pop(csv_file, None)
+    save_manifest(manifest)
+
+    print_summary(results)
+    return results
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    results = main()
+    if any(error is not None for _, error, _ in results):
+        raise SystemExit(1)
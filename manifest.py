@@ -0,0 +1,48 @@
+# manifest.py
+import hashlib
+import json
+import os
+
+MANIFEST_FILE = "pipeline_manifest.json"
+
+# Output format version of each stage, recorded with its inputs. Bump a
+# stage's number whenever a code change alters what it writes, so manifests
+# from older runs no longer count as up to date. Kept here rather than in
+# column_mapper/distCalc so checking the manifest does not import pandas.
+STAGE_VERSIONS = {
+    "mapping": 1,
+    "distances": 2,  # 2: results ordered by Total Distance
+}
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(path=MANIFEST_FILE):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Ignoring unreadable manifest '{path}': {e}")
+        return {}
+
+def save_manifest(manifest, path=MANIFEST_FILE):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+
+def is_up_to_date(stage, inputs):
+    # A stage is skipped when it last ran with identical inputs and every
+    # output it produced is still on disk.
+    return (
+        stage is not None and
+        stage.get("inputs") == inputs and
+        all(os.path.exists(path) for path in stage.get("outputs", []))
+    )
+
+def stage_record(inputs, outputs):
+    return {"inputs": inputs, "outputs": [path for path in outputs if os.path.exists(path)]}
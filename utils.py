@@ -2,6 +2,9 @@
 import pandas as pd
 import numpy as np
 import json
+import threading
+import re
+from dataset import read_projected_csv
 
 pd.set_option('future.no_silent_downcasting', True)
 
@@ -9,6 +12,9 @@ def clean_column_names(columns):
     return columns.str.strip().str.replace('"', '', regex=False).str.replace("'", '', regex=False)
 
 def clean_cell_values(series):
+    # Numeric columns were already parsed on load and have nothing to strip
+    if pd.api.types.is_numeric_dtype(series):
+        return series
     series = series.astype(object)
     series = series.where(series.notna(), '')
     series = series.astype(str)
@@ -19,12 +25,19 @@ def clean_cell_values(series):
     except AttributeError:
         return series
 
-def robust_load_csv(filepath, expected_columns=None):
+# Columns the app reads from an export besides the mapped comparison columns
+DATA_COLUMNS = {'Compounds ID', 'Name', 'Formula', 'm/z', 'RT [min]'}
+NUMERIC_COLUMNS = {'m/z', 'RT [min]', 'Calc. MW'}
+
+def robust_load_csv(filepath, expected_columns=None, usecols=None, numeric_columns=()):
     try:
-        df = pd.read_csv(
-            filepath, encoding="ISO-8859-1", engine="python",
-            sep=",", quotechar='"', on_bad_lines="skip"
-        )
+        if usecols is not None:
+            df = read_projected_csv(filepath, usecols, numeric_columns)
+        else:
+            df = pd.read_csv(
+                filepath, encoding="ISO-8859-1", engine="python",
+                sep=",", quotechar='"', on_bad_lines="skip"
+            )
     except Exception as e:
         raise RuntimeError(f"[ERROR] Could not load {filepath}: {e}")
 
@@ -46,7 +59,8 @@ def apply_fallback_names(df):
             df[col] = np.nan
         else:
             df[col] = clean_cell_values(df[col])
-    df['Name'] = df['Name'].fillna(df['Formula']).fillna(df['m/z'])  # <- updated fallback chain
+    mz_text = df['m/z'].astype(str).where(df['m/z'].notna())
+    df['Name'] = df['Name'].fillna(df['Formula']).fillna(mz_text)  # <- updated fallback chain
     df['Formula'] = df['Formula'].fillna('---')
     return df
 
@@ -57,22 +71,101 @@ def ensure_column(df, col, default=''):
         df[col] = clean_cell_values(df[col])
     return df
 
-def load_and_prepare_data(data_file, distance_file, mapping_key):
-    # Load reference ("gold") compounds
-    distance_df = robust_load_csv(distance_file, expected_columns={'Compounds ID', 'Calc. MW', 'Name'})
-    distance_df = apply_fallback_names(distance_df)
-    gold_ids = distance_df['Compounds ID'].dropna().astype(str).tolist()
+# Per-comparison significance codes of prepared datasets
+SIG_NONE, SIG_UP, SIG_DOWN = 0, 1, -1
 
-    # Load main data
-    raw_data = robust_load_csv(data_file)
-    raw_data = apply_fallback_names(raw_data)
-    raw_data = ensure_column(raw_data, 'm/z')
-    raw_data = ensure_column(raw_data, 'RT [min]')
-    raw_data['Compounds ID'] = raw_data['Compounds ID'].astype(str)
+# Default significance cutoffs: |log2 fold change| above FC_THRESHOLD and
+# p-value below P_THRESHOLD. The app lets each session move them.
+FC_THRESHOLD = 0.5
+P_THRESHOLD = 0.05
+
+def significance_codes(fold_change, p_values, fc_threshold=FC_THRESHOLD, p_threshold=P_THRESHOLD):
+    # Works on one comparison's column or a whole compounds x comparisons array
+    significant = p_values < p_threshold
+    codes = np.zeros(np.shape(fold_change), dtype=np.int8, order='F')
+    codes[significant & (fold_change > fc_threshold)] = SIG_UP
+    codes[significant & (fold_change < -fc_threshold)] = SIG_DOWN
+    return codes
+
+def significance_masks(df, fc_col, pv_col=None, fc_threshold=FC_THRESHOLD, p_threshold=P_THRESHOLD):
+    # (up, down) boolean arrays for a comparison from its int8 code column, or
+    # reclassified from its fold-change and p-value columns for other cutoffs
+    if (fc_threshold, p_threshold) == (FC_THRESHOLD, P_THRESHOLD):
+        codes = df[f'{fc_col}_sig'].to_numpy()
+    else:
+        codes = significance_codes(df[fc_col].to_numpy(), df[pv_col].to_numpy(), fc_threshold, p_threshold)
+    return codes == SIG_UP, codes == SIG_DOWN
+
+class ComparisonArrays:
+    # Fold change, p-value, -log10(p) and significance code of every comparison
+    # as compounds x comparisons arrays; column j belongs to comparisons[j] and
+    # is NaN (never significant) when the export lacks its columns. -log10(p)
+    # and the codes are computed for all comparisons in one batched pass, and
+    # the arrays are Fortran-ordered so each comparison's column is contiguous.
+    def __init__(self, fold_change, p_values):
+        self.fold_change = fold_change
+        self.p_values = p_values
+        self.log_p = np.empty(fold_change.shape, dtype=fold_change.dtype, order='F')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.log10(p_values, out=self.log_p)
+        np.negative(self.log_p, out=self.log_p)
+        self.sig = significance_codes(fold_change, p_values)
 
-    # Add 'Gold' column using concat to avoid fragmentation
-    raw_data = pd.concat([raw_data, pd.DataFrame({'Gold': raw_data['Compounds ID'].isin(gold_ids)})], axis=1).copy()
+    def __len__(self):
+        return self.fold_change.shape[1]
 
+    def values(self, idx):
+        # (fold change, -log10(p)) of one comparison
+        return self.fold_change[:, idx], self.log_p[:, idx]
+
+    def significance(self, idx, fc_threshold=FC_THRESHOLD, p_threshold=P_THRESHOLD):
+        # (up, down) masks; other cutoffs are reclassified from the cached
+        # fold-change and p-value columns without touching the frame
+        if (fc_threshold, p_threshold) == (FC_THRESHOLD, P_THRESHOLD):
+            codes = self.sig[:, idx]
+        else:
+            codes = significance_codes(self.fold_change[:, idx], self.p_values[:, idx], fc_threshold, p_threshold)
+        return codes == SIG_UP, codes == SIG_DOWN
+
+    def columns(self, comparisons):
+        # Frame columns named as before, as views into the arrays
+        columns = {}
+        for j, entry in enumerate(comparisons):
+            fc_col = entry.get("fold_change_col")
+            pv_col = entry.get("p_value_col")
+            columns[fc_col] = self.fold_change[:, j]
+            columns[pv_col] = self.p_values[:, j]
+            columns[f'-Log10({pv_col})'] = self.log_p[:, j]
+            columns[f'{fc_col}_sig'] = self.sig[:, j]
+        return columns
+
+def comparison_arrays(raw_data, comparisons, dtype=np.float64):
+    # Raw p-values stay float64 whatever `dtype` is: the p-value cutoff and the
+    # table need the precision
+    shape = (len(raw_data), len(comparisons))
+    fold_change = np.full(shape, np.nan, dtype=dtype, order='F')
+    p_values = np.full(shape, np.nan, order='F')
+    for j, entry in enumerate(comparisons):
+        fc_col = entry.get("fold_change_col")
+        pv_col = entry.get("p_value_col")
+        if fc_col in raw_data.columns and pv_col in raw_data.columns:
+            fold_change[:, j] = pd.to_numeric(clean_cell_values(raw_data[fc_col]), errors='coerce')
+            p_values[:, j] = pd.to_numeric(clean_cell_values(raw_data[pv_col]), errors='coerce')
+    return ComparisonArrays(fold_change, p_values)
+
+def compact_columns(df):
+    # Only the columns the app uses, with Name/Formula as categoricals. m/z and
+    # RT stay float64: ppm search needs the precision.
+    return {
+        'Compounds ID': df['Compounds ID'],
+        'Name': df['Name'].astype('category'),
+        'Formula': df['Formula'].astype('category'),
+        'm/z': pd.to_numeric(df['m/z'], errors='coerce'),
+        'RT [min]': pd.to_numeric(df['RT [min]'], errors='coerce'),
+        'Gold': df['Gold'],
+    }
+
+def load_prepared_dataset(data_file, distance_file, mapping_key, compact=False):
     # Load comparison metadata from specific JSON file
     mapping_file = mapping_key.replace(".csv", "_column_mapping.json")
     with open(mapping_file) as f:
@@ -82,21 +175,247 @@ def load_and_prepare_data(data_file, distance_file, mapping_key):
     if not comparisons:
         raise ValueError(f"No comparisons found in {mapping_file} for key: {mapping_key}")
 
-    # Compute derived columns (efficiently)
-    for entry in comparisons:
-        fc_col = entry.get("fold_change_col")
-        pv_col = entry.get("p_value_col")
+    # Load reference ("gold") compounds
+    distance_columns = {'Compounds ID', 'Calc. MW', 'Name'}
+    distance_df = robust_load_csv(distance_file, expected_columns=distance_columns,
+                                  usecols=distance_columns, numeric_columns=NUMERIC_COLUMNS)
+    distance_df = apply_fallback_names(distance_df)
+    gold_ids = distance_df['Compounds ID'].dropna().astype(str).tolist()
 
-        if fc_col in raw_data.columns and pv_col in raw_data.columns:
-            raw_data[fc_col] = pd.to_numeric(clean_cell_values(raw_data[fc_col]), errors='coerce')
-            raw_data[pv_col] = pd.to_numeric(clean_cell_values(raw_data[pv_col]), errors='coerce')
+    # Load main data, reading only the columns the app and the mapping use
+    comparison_columns = {entry.get(key) for entry in comparisons for key in ("fold_change_col", "p_value_col")}
+    raw_data = robust_load_csv(data_file, usecols=DATA_COLUMNS | comparison_columns,
+                               numeric_columns=NUMERIC_COLUMNS | comparison_columns)
+    raw_data = apply_fallback_names(raw_data)
+    raw_data = ensure_column(raw_data, 'm/z')
+    raw_data = ensure_column(raw_data, 'RT [min]')
+    raw_data['Compounds ID'] = raw_data['Compounds ID'].astype(str)
+    raw_data['Gold'] = raw_data['Compounds ID'].isin(gold_ids)
+
+    # Derived columns for every comparison in one allocation per quantity;
+    # compact mode stores fold change and -log10(p) as float32
+    arrays = comparison_arrays(raw_data, comparisons, np.float32 if compact else np.float64)
+    if compact:
+        columns = compact_columns(raw_data)
+    else:
+        columns = {col: raw_data[col] for col in raw_data.columns if col not in comparison_columns}
+    columns.update(arrays.columns(comparisons))
+
+    # copy=False keeps the comparison columns as views into `arrays`
+    return pd.DataFrame(columns, index=raw_data.index, copy=False), comparisons, arrays
+
+def load_and_prepare_data(data_file, distance_file, mapping_key, compact=False):
+    df, comparisons, _ = load_prepared_dataset(data_file, distance_file, mapping_key, compact)
+    return df, comparisons
+
+_NUMBER = r'(\d+(?:\.\d*)?|\.\d+)'
+# The tolerance needs a ± sign or whitespace before it, so '30110ppm' is not
+# read as 3011 ±0 ppm
+MZ_PPM_QUERY = re.compile(rf'^{_NUMBER}\s*(?:(?:±|\+/-|\+-)\s*|\s+){_NUMBER}\s*ppm$', re.IGNORECASE)
+MZ_RANGE_QUERY = re.compile(rf'^{_NUMBER}\s*(?:-|–|\.\.|to)\s*{_NUMBER}$', re.IGNORECASE)
+MZ_EXACT_QUERY = re.compile(rf'^{_NUMBER}$')
+
+class MzIndex:
+    # Sorted numeric m/z values of a table, answering queries by binary search.
+    # Lookups return row positions in the table's own order.
+    def __init__(self, mz):
+        values = pd.to_numeric(pd.Series(mz), errors='coerce').to_numpy(dtype=float)
+        valid = np.flatnonzero(~np.isnan(values))
+        self.order = valid[np.argsort(values[valid], kind='stable')]
+        self.values = values[self.order]
+
+    def range(self, low, high):
+        lo = np.searchsorted(self.values, low, side='left')
+        hi = np.searchsorted(self.values, high, side='right')
+        return np.sort(self.order[lo:hi])
+
+    def ppm(self, mz, ppm):
+        tolerance = mz * ppm * 1e-6
+        return self.range(mz - tolerance, mz + tolerance)
+
+    def exact(self, text):
+        # Match at the precision typed: "301.2" finds 301.15 <= m/z <= 301.25
+        decimals = len(text.partition('.')[2])
+        half_step = 0.5 * 10 ** -decimals
+        return self.range(float(text) - half_step, float(text) + half_step)
+
+    def prefix(self, digits):
+        # Integer part starting with `digits`, as a search typed digit by digit
+        # expects: "30" finds 30.x, 300-309.x, 3000-3099.x, ...
+        n = int(digits)
+        top = self.values[-1] if len(self.values) else 0
+        bounds, scale = [(n, n + 1)], 10
+        while n and n * scale <= top:
+            bounds.append((n * scale, (n + 1) * scale))
+            scale *= 10
+        hits = [self.order[np.searchsorted(self.values, low, side='left'):
+                           np.searchsorted(self.values, high, side='left')]
+                for low, high in bounds]
+        return np.sort(np.concatenate(hits))
+
+    def search(self, query):
+        # Supports "301.2", "300-305" / "300..305" and "301.2 ±10ppm"; a bare
+        # integer matches by prefix. Returns None for anything else so callers
+        # can fall back to text search
+        query = query.strip()
+        if match := MZ_PPM_QUERY.match(query):
+            return self.ppm(float(match.group(1)), float(match.group(2)))
+        if match := MZ_RANGE_QUERY.match(query):
+            low, high = sorted((float(match.group(1)), float(match.group(2))))
+            return self.range(low, high)
+        if MZ_EXACT_QUERY.match(query):
+            return self.exact(query) if '.' in query else self.prefix(query)
+        return None
+
+class TableOrder:
+    # A comparison table in one sort order, built once. `rank` maps a row
+    # position in the source table to its position here, so filter results
+    # come out in this order without re-sorting the table.
+    def __init__(self, table, column=None, ascending=True):
+        if column is None:
+            order = np.arange(len(table))
+        else:
+            values = pd.to_numeric(table[column], errors='coerce').to_numpy(dtype=float)
+            order = np.argsort(values if ascending else -values, kind='stable')
+        self.frame = table.iloc[order]
+        self.rank = np.empty(len(order), dtype=np.intp)
+        self.rank[order] = np.arange(len(order))
+
+    def rows(self, rows):
+        # Row positions (or a boolean mask) of the source table, in this order
+        return self.frame.iloc[np.sort(self.rank[rows])]
+
+class SharedDataset:
+    # One prepared dataset, shared read-only by every session in the process.
+    # `derived` memoizes values computed from it (lookup maps, table frames).
+    def __init__(self, df, comparisons, arrays=None):
+        self.df = df
+        self.comparisons = comparisons
+        self.arrays = arrays
+        self._derived = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def derived(self, key, build):
+        # Built values are read without locking; a build only blocks callers
+        # waiting on the same key
+        try:
+            return self._derived[key]
+        except KeyError:
+            pass
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._derived:
+                self._derived[key] = build()
+            return self._derived[key]
+
+class TissueIndex:
+    # Join index over the prepared datasets of several tissues (name ->
+    # SharedDataset). Compounds IDs are row numbers local to each export, so
+    # tissues are joined by m/z only: values are hashed into log-scale bins one
+    # `ppm` tolerance wide, so every match sits in the query's bin or a
+    # neighbour and a lookup reads three buckets per tissue instead of
+    # scanning each frame.
+    def __init__(self, tissues, ppm=10):
+        self.tissues = tissues
+        self.ppm = ppm
+        self._bin_width = -np.log1p(-ppm * 1e-6)
+        self._ids = {}
+        self._mz = {}
+        self._mz_bins = {}
+        for name, shared in tissues.items():
+            df = shared.df
+            self._ids[name] = shared.derived('compound_positions',
+                                             lambda: df.groupby('Compounds ID', sort=False).indices)
+            mz = pd.to_numeric(df['m/z'], errors='coerce').to_numpy(dtype=float)
+            rows = np.flatnonzero(mz > 0)
+            groups = pd.Series(rows).groupby(self._bin(mz[rows])).indices
+            self._mz[name] = mz
+            self._mz_bins[name] = {b: rows[positions] for b, positions in groups.items()}
+
+    def _bin(self, mz):
+        return np.floor(np.log(mz) / self._bin_width).astype(np.int64)
+
+    def by_id(self, tissue, compound_id):
+        # Row positions of a compound within one tissue (None if absent)
+        positions = self._ids.get(tissue)
+        return None if positions is None else positions.get(compound_id)
+
+    def by_mz(self, mz, ppm=None):
+        # tissue -> row positions with m/z within ppm (at most the index's ppm)
+        ppm = self.ppm if ppm is None else min(ppm, self.ppm)
+        tolerance = mz * ppm * 1e-6
+        center = int(self._bin(np.float64(mz)))
+        found = {}
+        for name, bins in self._mz_bins.items():
+            candidates = [bins[b] for b in (center - 1, center, center + 1) if b in bins]
+            if candidates:
+                rows = np.sort(np.concatenate(candidates))
+                rows = rows[np.abs(self._mz[name][rows] - mz) <= tolerance]
+                if len(rows):
+                    found[name] = rows
+        return found
+
+    def compound_view(self, tissue, compound_ids, fc_threshold=FC_THRESHOLD, p_threshold=P_THRESHOLD, gold=None):
+        # Long-format frame with a compound's fold change, p-value and
+        # significance in every comparison of every tissue: its own rows, then
+        # rows of other tissues within ppm of its m/z. `gold` maps tissue ->
+        # row mask; tissues without one use their 'Gold' column.
+        gold = gold or {}
+        records = []
+        for compound_id in compound_ids:
+            home = self.by_id(tissue, compound_id)
+            if home is None:
+                continue
+            mz = self._mz[tissue][home[0]]
+            matches = {tissue: home}
+            if mz > 0:
+                for name, rows in self.by_mz(mz).items():
+                    if name != tissue:
+                        matches[name] = rows
+            for name, rows in matches.items():
+                records.extend(self._records(name, rows, compound_id, name == tissue, mz, gold.get(name),
+                                             fc_threshold, p_threshold))
+        return pd.DataFrame(records, columns=['Query', 'Tissue', 'Compounds ID', 'Name', 'm/z', 'Match',
+                                              'Gold', 'Comparison', 'Log2 Fold', 'P-val', 'Significance'])
+
+    def _records(self, name, rows, query, home, query_mz, gold, fc_threshold, p_threshold):
+        shared = self.tissues[name]
+        df, arrays = shared.df, shared.arrays
+        if gold is None:
+            gold = df['Gold'].to_numpy(dtype=bool)
+        fold_change = arrays.fold_change[rows]
+        p_values = arrays.p_values[rows]
+        codes = significance_codes(fold_change, p_values, fc_threshold, p_threshold)
+        labels = {SIG_UP: 'up', SIG_DOWN: 'down', SIG_NONE: ''}
+        for i, row in enumerate(rows):
+            mz = self._mz[name][row]
+            label = 'query' if home else f"{(mz - query_mz) / query_mz * 1e6:+.1f} ppm"
+            for j, entry in enumerate(shared.comparisons):
+                yield (query, name, df['Compounds ID'].iat[row], df['Name'].iat[row], mz, label,
+                       bool(gold[row]), entry.get("title", f"Comparison {j+1}"),
+                       fold_change[i, j], p_values[i, j], labels[codes[i, j]])
+
+class DatasetStore:
+    # Process-wide registry so a dataset is loaded and prepared once
+    # rather than once per browser session.
+    def __init__(self):
+        self._datasets = {}
+        self._locks = {}
+        self._lock = threading.Lock()
 
-            new_cols = pd.DataFrame({
-                f'-Log10({pv_col})': -np.log10(raw_data[pv_col]),
-                f'{fc_col}_sig_up': (raw_data[fc_col] > 0.5) & (raw_data[pv_col] < 0.05),
-                f'{fc_col}_sig_down': (raw_data[fc_col] < -0.5) & (raw_data[pv_col] < 0.05),
-            })
+    def get(self, data_file, distance_file, mapping_key, compact=False):
+        key = (data_file, distance_file, mapping_key, compact)
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._datasets:
+                self._datasets[key] = SharedDataset(*load_prepared_dataset(*key))
+            return self._datasets[key]
 
-            raw_data = pd.concat([raw_data, new_cols], axis=1).copy()
+    def clear(self):
+        with self._lock:
+            self._datasets.clear()
 
-    return raw_data, comparisons
\ No newline at end of file
+DATASETS = DatasetStore()
\ No newline at end of file
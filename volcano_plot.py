@@ -1,8 +1,196 @@
 # volcano_plot.py
 import plotly.graph_objects as go
 import numpy as np
+import threading
+from collections import OrderedDict
+from utils import significance_masks, FC_THRESHOLD, P_THRESHOLD
 
-def generate_plot(df, comparison_idx, comparisons, selected_ids=None):
+# Plots with more points than this are drawn with WebGL (Scattergl), and their
+# insignificant (blue) background is thinned to one point per grid cell
+LARGE_PLOT_POINTS = 50000
+DECIMATION_GRID = 256
+
+class FigureCache:
+    # Least-recently-used store of built figures keyed by (dataset, comparison
+    # index). Colors and hover text live inside each figure, so a hit skips all
+    # of generate_plot; at most `maxsize` figures are kept alive. Lookups from
+    # worker threads and the event loop are serialized by a lock.
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            fig = self._figures.get(key)
+            if fig is not None:
+                self._figures.move_to_end(key)
+            return fig
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._figures
+
+    def put(self, key, fig):
+        with self._lock:
+            self._figures[key] = fig
+            self._figures.move_to_end(key)
+            while len(self._figures) > self.maxsize:
+                self._figures.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._figures)
+
+def cached_plot(cache, dataset_key, df, comparison_idx, comparisons, prebuilt=None, **plot_options):
+    # `prebuilt` is a figure from prebuild_plot, used if the cache still misses
+    key = (dataset_key, comparison_idx)
+    fig = cache.get(key)
+    if fig is not None:
+        # Drop any selection left over from the last time it was shown, and
+        # recolor if the cutoffs or gold set changed since it was built
+        if fig.data[0].selectedpoints is not None:
+            fig.data[0].selectedpoints = None
+        if not update_thresholds(fig, df, comparison_idx, comparisons,
+                                 plot_options.get('fc_threshold', FC_THRESHOLD),
+                                 plot_options.get('p_threshold', P_THRESHOLD),
+                                 plot_options.get('arrays'), plot_options.get('gold')):
+            fig = None
+    if fig is None:
+        fig = prebuilt if prebuilt is not None else generate_plot(df, comparison_idx, comparisons, **plot_options)
+        cache.put(key, fig)
+    return fig
+
+# Hooks a Plotly pane installs on the figure it shows, so figure updates are
+# sent to the browser
+PANE_HOOKS = ('_send_addTraces_msg', '_send_moveTraces_msg', '_send_deleteTraces_msg',
+              '_send_restyle_msg', '_send_relayout_msg', '_send_update_msg', '_send_animate_msg')
+
+def unlink_figure(fig):
+    # Detach a figure that has left the pane: its hooks still point at the pane
+    # and would apply later updates (a cache hit being recolored) to whatever
+    # figure is on screen. The pane relinks it if it is shown again.
+    if fig is not None:
+        for hook in PANE_HOOKS:
+            fig.__dict__.pop(hook, None)
+
+def prebuild_plot(cache, dataset_key, df, comparison_idx, comparisons, **plot_options):
+    # Build a missing figure without touching the cache: figures that have
+    # been shown are linked to a live plot pane, so this is the part of
+    # cached_plot that is safe to run off the event loop. Returns None on a
+    # hit; the caller passes the figure to cached_plot back on the loop.
+    if (dataset_key, comparison_idx) in cache:
+        return None
+    return generate_plot(df, comparison_idx, comparisons, **plot_options)
+
+def compound_positions(df):
+    # Compound ID -> row positions, so a selection resolves without scanning df
+    return df.groupby('Compounds ID', sort=False).indices
+
+def selection_indices(positions, selected_ids):
+    # None clears the selection; otherwise unselected points are dimmed
+    if not selected_ids:
+        return None
+    hits = [positions[i] for i in selected_ids if i in positions]
+    return np.sort(np.concatenate(hits)).tolist() if hits else []
+
+def update_selection(fig, positions, selected_ids):
+    # Only the selectedpoints array of the scatter trace is sent to the browser.
+    # Returns False if a selected compound was decimated out of the figure, in
+    # which case the caller has to regenerate it with the selection.
+    selected = selection_indices(positions, selected_ids)
+    plot_rows = getattr(fig, '_plot_rows', None)
+    if plot_rows is not None and selected:
+        selected = trace_positions(plot_rows, selected)
+        if selected is None:
+            return False
+    fig.data[0].selectedpoints = selected
+    return True
+
+# Color codes 0-3 are drawn as blue/red/green/gold through a stepped colorscale;
+# Plotly validates a numeric array at once but a list of color names one by one
+COLOR_CODES = {'blue': 0, 'red': 1, 'green': 2, 'gold': 3}
+CODE_COLORSCALE = [[0, 'blue'], [1/6, 'blue'], [1/6, 'red'], [1/2, 'red'],
+                   [1/2, 'green'], [5/6, 'green'], [5/6, 'gold'], [1, 'gold']]
+
+def point_colors(gold, sig_up, sig_down):
+    return np.where(gold, COLOR_CODES['gold'],
+             np.where(sig_up, COLOR_CODES['green'],
+             np.where(sig_down, COLOR_CODES['red'], COLOR_CODES['blue']))).astype(np.uint8)
+
+def threshold_shapes(fc_threshold=FC_THRESHOLD, p_threshold=P_THRESHOLD, color="white"):
+    # Dashed cutoff lines: -log10(p) = -log10(p_threshold) and x = ±fc_threshold.
+    # A p cutoff of 0 or less has no finite line, so only the fold-change lines are drawn.
+    shapes = [
+        dict(type="line", x0=-fc_threshold, x1=-fc_threshold, y0=0, y1=1, yref="paper",
+            line=dict(color=color, dash="dash")),
+        dict(type="line", x0=fc_threshold, x1=fc_threshold, y0=0, y1=1, yref="paper",
+            line=dict(color=color, dash="dash"))
+    ]
+    if p_threshold > 0:
+        shapes.insert(0, dict(type="line", x0=-8, x1=8, y0=-np.log10(p_threshold), y1=-np.log10(p_threshold),
+            line=dict(color=color, dash="dash")))
+    return shapes
+
+def update_thresholds(fig, df, comparison_idx, comparisons, fc_threshold, p_threshold, arrays=None, gold=None):
+    # Recolor an existing figure for new cutoffs or a new gold mask (None is
+    # the 'Gold' column): only marker.color and the cutoff lines are sent to
+    # the browser. Returns False if a point that is now significant or gold was
+    # decimated out, in which case the caller regenerates.
+    if getattr(fig, '_thresholds', None) == (fc_threshold, p_threshold) and getattr(fig, '_gold', None) is gold:
+        return True
+    gold_mask = df['Gold'].to_numpy(dtype=bool) if gold is None else gold
+    entry = comparisons[comparison_idx]
+    if arrays is not None:
+        sig_up, sig_down = arrays.significance(comparison_idx, fc_threshold, p_threshold)
+    else:
+        sig_up, sig_down = significance_masks(df, entry.get("fold_change_col"), entry.get("p_value_col"),
+                                              fc_threshold, p_threshold)
+
+    plot_rows = getattr(fig, '_plot_rows', None)
+    if plot_rows is not None:
+        foreground = np.flatnonzero(gold_mask | sig_up | sig_down)
+        if len(foreground) and trace_positions(plot_rows, foreground) is None:
+            return False
+        gold_mask, sig_up, sig_down = gold_mask[plot_rows], sig_up[plot_rows], sig_down[plot_rows]
+
+    with fig.batch_update():
+        fig.data[0].marker.color = point_colors(gold_mask, sig_up, sig_down)
+        fig.layout.shapes = threshold_shapes(fc_threshold, p_threshold)
+    fig._thresholds = (fc_threshold, p_threshold)
+    fig._gold = gold
+    return True
+
+def trace_positions(plot_rows, rows):
+    # Map dataframe rows to positions in a decimated trace (None if any is missing)
+    rows = np.asarray(rows)
+    positions = np.searchsorted(plot_rows, rows)
+    if (positions >= len(plot_rows)).any() or (plot_rows[positions] != rows).any():
+        return None
+    return positions.tolist()
+
+def decimate_background(x, y, background, grid=DECIMATION_GRID):
+    # Row positions to draw: every foreground point plus one background point
+    # per cell of a grid x grid raster over the background's extent.
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = ~background
+    rows = np.flatnonzero(background & np.isfinite(x) & np.isfinite(y))
+    if len(rows):
+        bx, by = x[rows], y[rows]
+        cx = ((bx - bx.min()) / (np.ptp(bx) or 1) * (grid - 1)).astype(np.int64)
+        cy = ((by - by.min()) / (np.ptp(by) or 1) * (grid - 1)).astype(np.int64)
+        _, first = np.unique(cx * grid + cy, return_index=True)
+        keep[rows[first]] = True
+    return np.flatnonzero(keep)
+
+def generate_plot(df, comparison_idx, comparisons, selected_ids=None,
+                  webgl_threshold=LARGE_PLOT_POINTS, decimation_grid=DECIMATION_GRID, arrays=None,
+                  fc_threshold=FC_THRESHOLD, p_threshold=P_THRESHOLD, gold=None):
     # Get comparison info
     entry = comparisons[comparison_idx]
     fc_col = entry.get("fold_change_col")
@@ -12,16 +200,41 @@ def generate_plot(df, comparison_idx, comparisons, selected_ids=None):
     # Create figure
     fig = go.Figure()
 
-    # Determine opacity based on selection
-    if selected_ids is None or len(selected_ids) == 0:
-        opacity = np.ones(len(df))
+    # Rows whose compound is selected
+    selected_rows = selection_indices(compound_positions(df), selected_ids) if selected_ids else None
+
+    # Coordinates and significance, by comparison index from the prepared
+    # ComparisonArrays when the caller has them
+    if arrays is not None:
+        x, y = arrays.values(comparison_idx)
+        sig_up, sig_down = arrays.significance(comparison_idx, fc_threshold, p_threshold)
     else:
-        opacity = np.where(df['Compounds ID'].isin(selected_ids), 1.0, 0.005)
+        x, y = df[fc_col].to_numpy(), df[f'-Log10({pv_col})'].to_numpy()
+        sig_up, sig_down = significance_masks(df, fc_col, pv_col, fc_threshold, p_threshold)
+
+    # Gold points: the 'Gold' column unless the caller passes a row mask
+    gold_mask = df['Gold'].to_numpy(dtype=bool) if gold is None else gold
+
+    # Large plots: switch to WebGL and thin out the insignificant background,
+    # always keeping gold, significant and selected points
+    large = webgl_threshold is not None and len(df) > webgl_threshold
+    plot_rows = None
+    if large and decimation_grid:
+        background = ~(gold_mask | sig_up | sig_down)
+        if selected_rows:
+            background[selected_rows] = False
+        plot_rows = decimate_background(x, y, background, decimation_grid)
+        df = df.iloc[plot_rows]
+        x, y = x[plot_rows], y[plot_rows]
+        sig_up, sig_down, gold_mask = sig_up[plot_rows], sig_down[plot_rows], gold_mask[plot_rows]
+        if selected_rows is not None:
+            selected_rows = trace_positions(plot_rows, selected_rows) if selected_rows else []
+    fig._plot_rows = plot_rows
+    fig._thresholds = (fc_threshold, p_threshold)
+    fig._gold = gold
 
     # Determine colors
-    color_map = np.where(df['Gold'], 'gold',
-                  np.where(df[f'{fc_col}_sig_up'], 'green',
-                  np.where(df[f'{fc_col}_sig_down'], 'red', 'blue')))
+    color_map = point_colors(gold_mask, sig_up, sig_down)
 
     # Create hover text
     hover_text = (
@@ -33,11 +246,14 @@ def generate_plot(df, comparison_idx, comparisons, selected_ids=None):
     )
 
     # Add main scatter plot
-    fig.add_trace(go.Scatter(
-        x=df[fc_col],
-        y=df[f'-Log10({pv_col})'],
+    scatter = go.Scattergl if large else go.Scatter
+    fig.add_trace(scatter(
+        x=x,
+        y=y,
         mode='markers',
-        marker=dict(color=color_map, opacity=opacity),
+        marker=dict(color=color_map, colorscale=CODE_COLORSCALE, cmin=0, cmax=3),
+        selectedpoints=selected_rows,
+        unselected=dict(marker=dict(opacity=0.005)),
         hovertext=hover_text,
         hoverinfo='text',
         name=title,
@@ -47,7 +263,7 @@ def generate_plot(df, comparison_idx, comparisons, selected_ids=None):
     # Add legend traces
     legend_traces = [
         go.Scatter(x=[None], y=[None], mode='markers', marker=dict(size=12, color='gold'),
-                  showlegend=True, name='Top 50 Distance'),
+                  showlegend=True, name='Gold (nearest to corner)'),
         go.Scatter(x=[None], y=[None], mode='markers', marker=dict(size=12, color='green'),
                   showlegend=True, name='Significant Upregulated'),
         go.Scatter(x=[None], y=[None], mode='markers', marker=dict(size=12, color='red'),
@@ -67,14 +283,7 @@ def generate_plot(df, comparison_idx, comparisons, selected_ids=None):
         plot_bgcolor="#4f4f4f",
         paper_bgcolor="#4f4f4f",
         font=dict(color="white"),
-        shapes=[
-            dict(type="line", x0=-8, x1=8, y0=-np.log10(0.05), y1=-np.log10(0.05),
-                line=dict(color="white", dash="dash")),
-            dict(type="line", x0=-0.5, x1=-0.5, y0=0, y1=1, yref="paper",
-                line=dict(color="white", dash="dash")),
-            dict(type="line", x0=0.5, x1=0.5, y0=0, y1=1, yref="paper",
-                line=dict(color="white", dash="dash"))
-        ],
+        shapes=threshold_shapes(fc_threshold, p_threshold),
         legend=dict(font=dict(color="white"), bgcolor="#5f5f5f")
     )
 